@@ -0,0 +1,126 @@
+# Compares the lambda-table notification decoding BluetoothCover used to do
+# with the preallocated records in curtainframes.
+#
+#   python bench/bench_decoder.py [frames]
+import sys
+
+import hostenv
+
+hostenv.install()
+
+import constants  # noqa: E402
+from curtainframes import AdvancedFrame, StatusFrame  # noqa: E402
+
+STATUS_FRAMES = [
+    b"\x012,\x01x\x0c\x00\x00",
+    b"\x012,\x01x\x04\x00\x00",
+    b"\x012,\x01x\x0d\x2a\x00",
+    b"\x012,\x01x\x0e\x64\x00",
+]
+ADVANCED_FRAMES = [
+    b"\x012,\x05\x00\x00\x00",
+    b"\x012,\x01\x00\x00\x00",
+]
+
+
+def _byte_to_bin_str(byte):
+    bin_value = f"{byte:b}"
+    bin_value = f"{bin_value:0>4}"
+    return bin_value
+
+
+def _names_to_map(names, value):
+    result = {}
+    for name in names:
+        result[name[0]] = name[1](value)
+    return result
+
+
+LEGACY_STATE_2_NAMES = [
+    ("is_solar_panel_connected", lambda bitStr: bitStr[0] == "1"),
+    ("is_calibrated", lambda bitStr: bitStr[1] == "1"),
+    ("motion_status", lambda bitStr: constants.MOTIONS[int(bitStr[2:4], 2)]),
+]
+LEGACY_NAMES = [
+    ("response_status", lambda byte_list: byte_list[0]),
+    ("battery_percentage", lambda byte_list: byte_list[1]),
+    ("firmware_version", lambda byte_list: byte_list[2]),
+    ("device_chain_length", lambda byte_list: byte_list[3]),
+    ("state_1", lambda byte_list: byte_list[4]),
+    ("state_2", lambda byte_list: _names_to_map(LEGACY_STATE_2_NAMES, _byte_to_bin_str(byte_list[5]))),
+    ("position", lambda byte_list: byte_list[6]),
+    ("number_of_timers", lambda byte_list: byte_list[7]),
+]
+LEGACY_ADV_NAMES = [
+    ("response_status", lambda byte_list: byte_list[0]),
+    ("battery_percentage", lambda byte_list: byte_list[1]),
+    ("firmware_version", lambda byte_list: byte_list[2]),
+    ("state_of_charge", lambda byte_list: constants.STATES_OF_CHARGE[int(byte_list[3])]),
+]
+
+
+def _pad(frame):
+    frame = bytearray(frame)
+    while len(frame) < 8:
+        frame.append(0)
+    return frame
+
+
+def legacy_status(frame):
+    return _names_to_map(LEGACY_NAMES, _pad(frame))
+
+
+def legacy_advanced(frame):
+    return _names_to_map(LEGACY_ADV_NAMES, _pad(frame))
+
+
+_status = StatusFrame()
+_advanced = AdvancedFrame()
+
+
+def compiled_status(frame):
+    return _status.decode(frame)
+
+
+def compiled_advanced(frame):
+    return _advanced.decode(frame)
+
+
+def check_equivalence():
+    for byte in range(256):
+        frame = b"\x012,\x01x" + bytes((byte,)) + b"\x00\x00"
+        try:
+            expected = legacy_status(frame)
+        except IndexError:
+            continue
+        expected = dict(expected, **{"state_2." + k: v for k, v in expected.pop("state_2").items()})
+        assert compiled_status(frame).to_dict() == expected, byte
+    for frame in ADVANCED_FRAMES:
+        assert compiled_advanced(frame).to_dict() == legacy_advanced(frame), frame
+
+
+def _ticks_us():
+    return sys.modules["utime"].ticks_us()
+
+
+def run(name, decode, frames, count):
+    start = _ticks_us()
+    for i in range(count):
+        decode(frames[i % len(frames)])
+    elapsed = max(_ticks_us() - start, 1)
+    allocated = sum(hostenv.allocated_bytes(decode, frame) for frame in frames) / len(frames)
+    print("{:<18} {:>12.0f} decodes/s {:>8.1f} bytes/frame".format(
+        name, count * 1000000 / elapsed, allocated))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    check_equivalence()
+    run("legacy status", legacy_status, STATUS_FRAMES, count)
+    run("compiled status", compiled_status, STATUS_FRAMES, count)
+    run("legacy advanced", legacy_advanced, ADVANCED_FRAMES, count)
+    run("compiled advanced", compiled_advanced, ADVANCED_FRAMES, count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# Measures how long a set_position command takes from the broker to the BLE
+# write, for the old check_msg() polling loop and for the stream based
+# MQTTClient, then how long the hub takes to be ready again after the
+# broker drops it. The broker stand-in runs in its own thread so the
+# blocking polling client can't stall it.
+#
+#   python bench/bench_mqtt.py [commands]
+import random
+import socket
+import sys
+import threading
+import time
+
+import hostenv
+
+hostenv.install()
+
+import uasyncio as asyncio  # noqa: E402
+import ulogging  # noqa: E402
+import curtaincommands  # noqa: E402
+from curtainhub import CurtainHub  # noqa: E402
+from curtaintopics import CurtainTopics  # noqa: E402
+from mqttclient import MQTTClient  # noqa: E402
+from mqttcurtain import MQTTCurtain  # noqa: E402
+
+MAC = "12:34:56:78:9A:BC"
+POLL_INTERVAL_MS = 200
+WRITE_TIMEOUT_S = 2
+
+
+def _read_packet(sock):
+    header = sock.recv(1)
+    if not header:
+        return None, None
+    size = 0
+    shift = 0
+    while True:
+        byte = sock.recv(1)[0]
+        size |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    body = b""
+    while len(body) < size:
+        chunk = sock.recv(size - len(body))
+        if not chunk:
+            return None, None
+        body += chunk
+    return header[0], body
+
+
+def _packet(header, body):
+    length = bytearray()
+    size = len(body)
+    while True:
+        byte = size & 0x7F
+        size >>= 7
+        length.append(byte | (0x80 if size else 0))
+        if not size:
+            break
+    return bytes([header]) + length + body
+
+
+class Broker(threading.Thread):
+    # Just enough of a broker: acknowledges connects, subscribes and pings,
+    # keeps retained messages and lets the bench push publishes to the
+    # connected client.
+    def __init__(self):
+        super().__init__(daemon=True)
+        self._server = socket.socket()
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(("127.0.0.1", 0))
+        self._server.listen(1)
+        self.port = self._server.getsockname()[1]
+        self._client = None
+        self._lock = threading.Lock()
+        self.retained = {}
+
+    def run(self):
+        while True:
+            client, _ = self._server.accept()
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._serve(client)
+
+    def _serve(self, client):
+        while True:
+            try:
+                header, body = _read_packet(client)
+            except OSError:
+                header = None
+            if header is None or header & 0xF0 == 0xE0:
+                client.close()
+                return
+            op = header & 0xF0
+            if op == 0x10:
+                self._client = client
+                self._send(client, _packet(0x20, b"\x00\x00"))
+            elif op == 0x80:
+                self._send(client, _packet(0x90, body[:2] + body[-1:]))
+                topic = body[4:-1]
+                if topic in self.retained:
+                    self._send(client, _packet(0x31, len(topic).to_bytes(2, "big") + topic + self.retained[topic]))
+            elif op == 0xA0:
+                self._send(client, _packet(0xB0, body[:2]))
+            elif op == 0xC0:
+                self._send(client, _packet(0xD0, b""))
+            elif op == 0x30:
+                topic_end = 2 + (body[0] << 8 | body[1])
+                msg_start = topic_end + (2 if header & 0x06 else 0)
+                if header & 0x01:
+                    self.retained[body[2:topic_end]] = body[msg_start:]
+                if header & 0x06:
+                    self._send(client, _packet(0x40, body[topic_end:topic_end + 2]))
+
+    def _send(self, client, packet):
+        with self._lock:
+            client.sendall(packet)
+
+    def publish(self, topic, msg):
+        topic = topic.encode()
+        self._send(self._client, _packet(0x30, len(topic).to_bytes(2, "big") + topic + msg.encode()))
+
+    def drop(self):
+        self._client.shutdown(socket.SHUT_RDWR)
+
+
+class PollingClient:
+    # The parts of umqtt.simple the hub used: a blocking socket that
+    # check_msg() peeks at without blocking.
+    def __init__(self, client_id, server, port):
+        self.client_id = client_id
+        self._address = (server, port)
+        self._sock = None
+        self._callback = None
+
+    def set_callback(self, callback):
+        self._callback = callback
+
+    async def connect(self, clean_session=True):
+        self._sock = socket.create_connection(self._address)
+        client_id = self.client_id.encode()
+        self._sock.sendall(_packet(0x10, b"\x00\x04MQTT\x04\x02\x00\x05" + len(client_id).to_bytes(2, "big") + client_id))
+        _read_packet(self._sock)
+
+    async def disconnect(self):
+        self._sock.close()
+
+    def subscribe(self, topic, qos=0):
+        topic = topic.encode()
+        self._sock.sendall(_packet(0x82, b"\x00\x01" + len(topic).to_bytes(2, "big") + topic + bytes([qos])))
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        topic = topic.encode()
+        if isinstance(msg, str):
+            msg = msg.encode()
+        self._sock.sendall(_packet(0x30 | retain, len(topic).to_bytes(2, "big") + topic + msg))
+
+    def check_msg(self):
+        self._sock.setblocking(False)
+        try:
+            first = self._sock.recv(1)
+        except BlockingIOError:
+            return None
+        finally:
+            self._sock.setblocking(True)
+        header, body = _read_packet(_Prefixed(first, self._sock))
+        if header & 0xF0 == 0x30:
+            topic_end = 2 + (body[0] << 8 | body[1])
+            self._callback(body[2:topic_end], body[topic_end:])
+        return header
+
+    async def run(self):
+        while True:
+            self.check_msg()
+            await asyncio.sleep_ms(POLL_INTERVAL_MS)
+
+
+class _Prefixed:
+    def __init__(self, first, sock):
+        self._first = first
+        self._sock = sock
+
+    def recv(self, size):
+        if self._first:
+            first, self._first = self._first, b""
+            return first
+        return self._sock.recv(size)
+
+
+async def _run_stream_client(client):
+    while True:
+        await client.wait_msg()
+
+
+class NullStream:
+    def write(self, text):
+        return len(text)
+
+
+async def measure(name, client, run, broker, count):
+    writes = []
+    written = asyncio.Event()
+    write = hostenv.ClientCharacteristic.write
+
+    async def timed_write(characteristic, data, response=False, timeout_ms=1000):
+        writes.append((time.perf_counter(), bytes(data)))
+        written.set()
+        await write(characteristic, data, response, timeout_ms)
+
+    hostenv.ClientCharacteristic.write = timed_write
+    curtain = MQTTCurtain(client, MAC)
+    client.set_callback(lambda topic, msg: asyncio.get_event_loop().create_task(
+        curtain.handle_message(topic.decode(), msg.decode())))
+    await client.connect(True)
+    curtain.subscribe()
+    reader = asyncio.get_event_loop().create_task(run(client))
+    await asyncio.sleep(0.3)
+    latencies = []
+    for i in range(count):
+        position = 100 if i % 2 else 0
+        frame = bytes(curtaincommands.move_to(position))
+        sent = time.perf_counter()
+        broker.publish(curtain.topics.set_position, str(position))
+        while True:
+            written.clear()
+            match = [at for at, data in writes if data == frame and at >= sent]
+            if match:
+                latencies.append((match[0] - sent) * 1000)
+                break
+            await asyncio.wait_for(written.wait(), WRITE_TIMEOUT_S)
+        # Land the next command at a random point of the poll interval.
+        await asyncio.sleep(random.uniform(0.05, 0.05 + POLL_INTERVAL_MS / 1000))
+    reader.cancel()
+    await client.disconnect()
+    hostenv.ClientCharacteristic.write = write
+    latencies.sort()
+    print("{:<8} {:>8.1f} ms p50 {:>8.1f} ms p99 {:>8.1f} ms max".format(
+        name, latencies[len(latencies) // 2], latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)],
+        latencies[-1]))
+
+
+async def _reconnected(hub, connects):
+    while hub.client.connects < connects or hub.last_reconnect is None:
+        await asyncio.sleep(0.01)
+    reconnect = hub.last_reconnect
+    hub.last_reconnect = None
+    return reconnect
+
+
+async def measure_reconnects(broker):
+    curtains = [("12:34:56:78:9A:B{}".format(i), CurtainTopics("bench{}".format(i), "Bench {}".format(i)))
+                for i in range(3)]
+    groups = [(CurtainTopics("group_bench", "Bench"), [mac for mac, _ in curtains])]
+    client = MQTTClient("hub", "127.0.0.1", broker.port, keepalive=5)
+    hub = CurtainHub(client, curtains, groups=groups)
+    hub.start()
+    hub.connect(True)
+    for name, connects in (("first", 1), ("again", 2)):
+        if connects > 1:
+            broker.drop()
+        reconnect = await _reconnected(hub, connects)
+        print("{:<8} {:>8} ms ready {:>8} bytes sent".format(name, reconnect["ms"], reconnect["bytes"]))
+    stats = hub.discovery.stats()
+    print("discovery {} documents, {} bytes, {} skipped".format(
+        stats["documents"], stats["bytes"], stats["skipped"]))
+
+
+async def main(count):
+    broker = Broker()
+    broker.start()
+    await measure("polling", PollingClient("bench", "127.0.0.1", broker.port), PollingClient.run, broker, count)
+    await measure("stream", MQTTClient("bench", "127.0.0.1", broker.port, keepalive=5),
+                  _run_stream_client, broker, count)
+    await measure_reconnects(broker)
+
+
+if __name__ == "__main__":
+    ulogging.basicConfig(stream=NullStream())
+    random.seed(1)
+    # The covers keep their tasks running, so don't wait for them to finish.
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    asyncio.get_event_loop().run_until_complete(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
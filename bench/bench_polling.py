@@ -0,0 +1,70 @@
+# Simulates curtain moves on a virtual clock and compares the BLE polls per
+# move and the delay of the final position report for the fixed one second
+# polling against the motion model driven polling.
+#
+#   python bench/bench_polling.py
+import hostenv
+
+hostenv.install()
+
+import constants  # noqa: E402
+import utime  # noqa: E402
+from motionmodel import MotionModel  # noqa: E402
+
+_now = [0]
+utime.ticks_ms = lambda: _now[0]
+
+MOVES = [(0, 100), (100, 0), (40, 60), (0, 30), (90, 85)]
+SPEEDS = [4, 8, 12]
+START_DELAY_MS = 300
+
+
+def curtain_position(start, target, speed, t):
+    travelled = max(0, t - START_DELAY_MS) * speed / 1000
+    if start < target:
+        return min(target, start + travelled)
+    return max(target, start - travelled)
+
+
+def simulate(start, target, speed, next_delay):
+    model = MotionModel()
+    model.update(start)
+    _now[0] = 0
+    model.start(target)
+    arrival = START_DELAY_MS + abs(target - start) * 1000 / speed
+    polls = 0
+    while True:
+        _now[0] += next_delay(model)
+        polls += 1
+        position = int(curtain_position(start, target, speed, _now[0]))
+        model.update(position)
+        if position == target and _now[0] >= arrival:
+            return polls, _now[0] - arrival
+
+
+def fixed(model):
+    return 1000
+
+
+def adaptive(model):
+    return model.next_poll_ms()
+
+
+def main():
+    for name, next_delay in (("fixed 1s", fixed), ("adaptive", adaptive)):
+        polls = 0
+        lag = 0
+        for speed in SPEEDS:
+            for start, target in MOVES:
+                move_polls, move_lag = simulate(start, target, speed, next_delay)
+                polls += move_polls
+                lag = max(lag, move_lag)
+        moves = len(SPEEDS) * len(MOVES)
+        print("{:<9} {:>6.2f} polls/move {:>6.0f} ms worst final report delay".format(
+            name, polls / moves, lag))
+    print("(default speed {} %/s, min poll {} ms)".format(
+        constants.DEFAULT_CURTAIN_SPEED, constants.MIN_POLL_INTERVAL_MS))
+
+
+if __name__ == "__main__":
+    main()
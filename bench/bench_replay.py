@@ -0,0 +1,78 @@
+# Replays synthetic streams of captured SwitchBot frames through
+# BluetoothCover._on_notification and the MQTTCurtain publish path.
+#
+#   python bench/bench_replay.py [frames]
+import sys
+
+import hostenv
+
+hostenv.install()
+
+import uasyncio as asyncio  # noqa: E402
+import ulogging  # noqa: E402
+import utime  # noqa: E402
+from mqttcurtain import MQTTCurtain  # noqa: E402
+
+MAC = "12:34:56:78:9A:BC"
+ADVANCED_FRAME = b"\x012,\x05\x00\x00\x00"
+
+
+def status_frame(position, motion):
+    return bytes((0x01, 0x32, 0x2C, 0x01, 0x78, 0x0C | motion, position, 0x00))
+
+
+def moving_stream():
+    # A curtain closing and opening again, polled once a second, with an
+    # advanced page every 20 frames.
+    frames = []
+    for position in list(range(0, 101, 4)) + list(range(100, -1, -4)):
+        frames.append(status_frame(position, 1 if len(frames) < 26 else 2))
+        if len(frames) % 20 == 0:
+            frames.append(ADVANCED_FRAME)
+    frames.append(status_frame(0, 0))
+    return frames
+
+
+def idle_stream():
+    return [status_frame(100, 0)] * 19 + [ADVANCED_FRAME]
+
+
+class NullStream:
+    def write(self, text):
+        return len(text)
+
+
+def new_curtain():
+    mqtt_client = hostenv.MQTTClient("bench", "localhost")
+    curtain = MQTTCurtain(mqtt_client, MAC)
+    return curtain, mqtt_client
+
+
+def replay(name, stream, count):
+    curtain, client = new_curtain()
+    on_notification = curtain.cover._on_notification
+    frames = [stream[i % len(stream)] for i in range(count)]
+    publishes = client.publishes
+    published_bytes = client.published_bytes
+    start = utime.ticks_us()
+    for frame in frames:
+        on_notification(frame)
+    elapsed = max(utime.ticks_diff(utime.ticks_us(), start), 1)
+    publishes = client.publishes - publishes
+    published_bytes = client.published_bytes - published_bytes
+    allocated = sum(hostenv.allocated_bytes(on_notification, frame) for frame in stream) / len(stream)
+    print("{:<8} {:>10.0f} frames/s {:>8.1f} bytes alloc/frame {:>6.2f} publishes/frame {:>8.1f} bytes out/frame".format(
+        name, count * 1000000 / elapsed, allocated, publishes / count, published_bytes / count))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    # Keep the hub's debug logging (and its formatting cost) but drop the output.
+    ulogging.basicConfig(stream=NullStream())
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    replay("moving", moving_stream(), count)
+    replay("idle", idle_stream(), count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Checks the length/header based frame classification against the string
+# matching BluetoothCover used to do, using the frames captured in packets.MD.
+#
+#   python bench/check_classifier.py
+import ast
+import os
+import re
+
+import hostenv
+
+hostenv.install()
+
+import curtainframes  # noqa: E402
+
+PACKETS = os.path.join(hostenv.SRC, "..", "packets.MD")
+
+
+def legacy_classify(notification):
+    if ",\\" in f"{notification}":
+        notification = bytearray(notification)
+        while len(notification) < 8:
+            notification.append(0)
+        if "x\\" in f"{notification}":
+            return "status"
+        return "advanced"
+    return None
+
+
+def classify(notification):
+    result = []
+    registry = curtainframes.FrameRegistry()
+    registry.register(curtainframes.STATUS_FRAME_LENGTH, lambda _: result.append("status"))
+    registry.register(curtainframes.ADVANCED_FRAME_LENGTH, lambda _: result.append("advanced"))
+    registry.dispatch(notification)
+    return result[0] if result else None
+
+
+def captured_frames():
+    with open(PACKETS) as f:
+        text = f.read()
+    return [ast.literal_eval(literal) for literal in re.findall(r"b'[^']*'", text)]
+
+
+def main():
+    frames = captured_frames()
+    for frame in frames:
+        old, new = legacy_classify(frame), classify(frame)
+        assert old == new, (frame, old, new)
+        print("{:<40} {}".format(repr(frame), new))
+    print("{} captured frames classified identically".format(len(frames)))
+
+    status = bytearray(b"\x012,\x01x\x0c\x00\x00")
+    misclassified = 0
+    for position in range(101):
+        for state_1 in range(256):
+            status[4] = state_1
+            status[6] = position
+            if legacy_classify(status) != "status":
+                misclassified += 1
+    print("{} synthetic status frames the string matching got wrong".format(misclassified))
+
+
+if __name__ == "__main__":
+    main()
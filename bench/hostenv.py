@@ -0,0 +1,275 @@
+# Small stand-ins for the MicroPython modules the hub imports, so the
+# benchmarks in this directory can run on desktop CPython.
+import asyncio
+import binascii
+import gc
+import os
+import sys
+import tempfile
+import time
+import types
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+class UUID:
+    def __init__(self, value):
+        self._value = value
+
+    def __eq__(self, other):
+        return isinstance(other, UUID) and self._value == other._value
+
+    def __hash__(self):
+        return hash(self._value)
+
+    def __repr__(self):
+        return "UUID({!r})".format(self._value)
+
+
+class DeviceDisconnectedError(Exception):
+    pass
+
+
+class GattError(Exception):
+    pass
+
+
+class ClientCharacteristic:
+    def __init__(self, service, end_handle, value_handle, properties, uuid):
+        self.service = service
+        self._end_handle = end_handle
+        self._value_handle = value_handle
+        self.properties = properties
+        self.uuid = uuid
+        self.cccd_handle = None
+        self.written = []
+        self._notifications = asyncio.Queue()
+        self._ring = None
+        self._captured = asyncio.Event()
+
+    async def write(self, data, response=False, timeout_ms=1000):
+        self.written.append(bytes(data))
+
+    async def subscribe(self, notify=True, indicate=False, cccd_handle=None):
+        self.cccd_handle = self._value_handle + 1
+
+    async def notified(self, timeout_ms=None):
+        return await self._notifications.get()
+
+    def capture(self, ring):
+        ring.clear()
+        self._ring = ring
+
+    async def notified_batch(self, handler, timeout_ms=None):
+        while not len(self._ring):
+            self._captured.clear()
+            await self._captured.wait()
+        handled = 0
+        while len(self._ring):
+            handler(self._ring.peek())
+            self._ring.discard()
+            handled += 1
+        return handled
+
+    def notify(self, data):
+        if self._ring is None:
+            self._notifications.put_nowait(data)
+        else:
+            self._ring.append(memoryview(data))
+            self._captured.set()
+
+
+class ClientService:
+    def __init__(self, connection, start_handle, end_handle, uuid):
+        self.connection = connection
+        self._start_handle = start_handle
+        self._end_handle = end_handle
+        self.uuid = uuid
+        self.characteristics = {}
+
+    async def characteristic(self, uuid, timeout_ms=2000):
+        if uuid not in self.characteristics:
+            value_handle = self._start_handle + 2 + 3 * len(self.characteristics)
+            self.characteristics[uuid] = ClientCharacteristic(
+                self, value_handle + 2, value_handle, 0x1C, uuid)
+        return self.characteristics[uuid]
+
+
+class Connection:
+    def __init__(self, device):
+        self.device = device
+        self._service = ClientService(self, 1, 16, None)
+        self._lost = asyncio.Event()
+
+    async def service(self, uuid, timeout_ms=2000):
+        return self._service
+
+    def is_connected(self):
+        return not self._lost.is_set()
+
+    def drop(self):
+        # Simulates the peripheral going away.
+        self._lost.set()
+        self.device._connection = None
+
+    async def disconnect(self, timeout_ms=2000):
+        self.drop()
+
+    async def disconnected(self, timeout_ms=60000, disconnect=False):
+        await self._lost.wait()
+
+
+class Device:
+    def __init__(self, addr_type, addr):
+        self.addr_type = addr_type
+        self.addr = addr if len(addr) == 6 else binascii.unhexlify(addr.replace(":", ""))
+        self._connection = None
+
+    async def connect(self, timeout_ms=10000, scan_duration_ms=None,
+                      min_conn_interval_us=None, max_conn_interval_us=None):
+        self.conn_interval_us = (min_conn_interval_us, max_conn_interval_us)
+        self._connection = self._connection or Connection(self)
+        return self._connection
+
+
+class MQTTClient:
+    def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0):
+        self.client_id = client_id
+        self.publishes = 0
+        self.published_bytes = 0
+        self.retained = {}
+        self._callback = None
+
+    def set_callback(self, callback):
+        self._callback = callback
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        pass
+
+    async def connect(self, clean_session=True):
+        return False
+
+    def subscribe(self, topic, qos=0):
+        pass
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        self.publishes += 1
+        self.published_bytes += len(topic) + len(msg)
+        if retain:
+            self.retained[topic] = msg
+
+    is_connected = True
+    window_full = False
+    sent_bytes = 0
+
+    def unsubscribe(self, topic):
+        pass
+
+    def ping(self):
+        pass
+
+    async def round_trip(self, timeout_ms):
+        return True
+
+    async def flush(self):
+        pass
+
+    async def wait_msg(self):
+        # Nothing ever arrives, keep the waiter referenced so it isn't
+        # collected while pending.
+        self._idle = getattr(self, "_idle", None) or asyncio.Event()
+        await self._idle.wait()
+
+    def stats(self):
+        return {"publishes": self.publishes, "published_bytes": self.published_bytes}
+
+
+class WLAN:
+    def __init__(self, interface):
+        pass
+
+    def active(self, *args):
+        return True
+
+    def isconnected(self):
+        return True
+
+
+def _notification_ring():
+    # The ring is plain Python, so use the real one from aioble.client.
+    with open(os.path.join(SRC, "lib", "aioble", "client.py")) as f:
+        source = f.read()
+    start = source.index("class NotificationRing:")
+    end = source.index("\n\n\n", start)
+    namespace = {}
+    exec(source[start:end], namespace)
+    return namespace["NotificationRing"]
+
+
+def _sleep_ms(ms):
+    return asyncio.sleep(ms / 1000)
+
+
+def _wait_for_ms(awaitable, timeout_ms):
+    return asyncio.wait_for(awaitable, timeout_ms / 1000)
+
+
+def install():
+    if "machine" in sys.modules:
+        return
+    _module("micropython", const=lambda value: value)
+    _module("machine", unique_id=lambda: b"\xde\xad\xbe\xef")
+    _module("ubinascii", hexlify=binascii.hexlify, unhexlify=binascii.unhexlify, crc32=binascii.crc32)
+    _module("bluetooth", UUID=UUID)
+    _module(
+        "utime",
+        ticks_ms=lambda: time.monotonic_ns() // 1000000,
+        ticks_us=lambda: time.monotonic_ns() // 1000,
+        ticks_diff=lambda new, old: new - old,
+        ticks_add=lambda ticks, delta: ticks + delta,
+    )
+    _module("network", WLAN=WLAN, STA_IF=0, AP_IF=1, AUTH_WPA_WPA2_PSK=3)
+    _module("aioble", Device=Device, DeviceDisconnectedError=DeviceDisconnectedError,
+            GattError=GattError, ADDR_PUBLIC=0, ADDR_RANDOM=1)
+    sys.modules["aioble"].client = _module(
+        "aioble.client", ClientService=ClientService, ClientCharacteristic=ClientCharacteristic,
+        NotificationRing=_notification_ring())
+    _module("uasyncio", **{k: v for k, v in vars(asyncio).items() if not k.startswith("__")})
+    sys.modules["uasyncio"].sleep_ms = _sleep_ms
+    sys.modules["uasyncio"].wait_for_ms = _wait_for_ms
+    if not hasattr(sys, "print_exception"):
+        sys.print_exception = lambda e, stream=None: print(repr(e), file=stream)
+    sys.path.insert(0, os.path.join(SRC, "lib"))
+    sys.path.insert(0, SRC)
+    # The hub keeps its json files in the working directory.
+    os.chdir(tempfile.mkdtemp(prefix="smart-curtain-"))
+
+
+def allocated_bytes(function, *args):
+    # Bytes allocated by a single call, using the MicroPython heap counters
+    # when available and tracemalloc's peak on CPython.
+    if hasattr(gc, "mem_alloc"):
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        function(*args)
+        after = gc.mem_alloc()
+        gc.enable()
+        return after - before
+    import tracemalloc
+
+    tracemalloc.start()
+    function(*args)
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - baseline
@@ -0,0 +1,79 @@
+import aioble
+import uasyncio as asyncio
+import ulogging
+
+import constants
+import curtainframes
+
+log = ulogging.getLogger(__name__)
+log.setLevel(ulogging.DEBUG)
+
+
+class AdvertisementScanner:
+    def __init__(self, duration_ms=constants.ADVERTISEMENT_SCAN_DURATION_MS,
+                 interval_us=constants.ADVERTISEMENT_SCAN_INTERVAL_US,
+                 window_us=constants.ADVERTISEMENT_SCAN_WINDOW_US):
+        self._duration_ms = duration_ms
+        self._interval_us = interval_us
+        self._window_us = window_us
+        self._handlers = {}
+        self.results = 0
+        self.delivered = 0
+        self.scans = 0
+        self.filtered = 0
+        self.duplicates = 0
+
+    def register(self, addr, handler):
+        self._handlers[bytes(addr)] = handler
+
+    async def run(self):
+        while True:
+            try:
+                # A connect cancels the scan, so it is restarted every time
+                # the previous one ends. The addresses already pick the
+                # curtains; a service filter would drop the ADV_IND with the
+                # manufacturer data, as the service data only comes in the
+                # scan response.
+                self.scans += 1
+                scanner = aioble.scan(
+                    self._duration_ms, self._interval_us, self._window_us, active=True,
+                    addresses=list(self._handlers), deduplicate=True,
+                    refresh_ms=constants.ADVERTISEMENT_REFRESH_MS)
+                try:
+                    async with scanner:
+                        async for result in scanner:
+                            self.results += 1
+                            handler = self._handlers.get(result.device.addr)
+                            if handler:
+                                self._deliver(result, handler)
+                finally:
+                    self.filtered += scanner.filtered
+                    self.duplicates += scanner.duplicates
+            except OSError as e:  # type: ignore
+                # Scanning is refused while a connection is being set up.
+                log.exc(e, "Scan failed")
+            await asyncio.sleep_ms(constants.ADVERTISEMENT_SCAN_PAUSE_MS)
+
+    def _deliver(self, result, handler):
+        service_data = None
+        for uuid, data in result.service_data():
+            if uuid in curtainframes.ADVERTISEMENT_SERVICE_UUIDS:
+                service_data = data
+                break
+        if service_data is None:
+            return
+        manufacturer_data = None
+        for _, data in result.manufacturer(curtainframes.WOAN_MANUFACTURER_ID):
+            manufacturer_data = data
+            break
+        self.delivered += 1
+        handler(service_data, manufacturer_data)
+
+    def stats(self):
+        return {
+            "scans": self.scans,
+            "results": self.results,
+            "delivered": self.delivered,
+            "filtered": self.filtered,
+            "duplicates": self.duplicates,
+        }
@@ -1,100 +1,302 @@
 import aioble
+from aioble.client import NotificationRing
 import uasyncio as asyncio
 import ulogging
+import utime
 
+import connectionstate
 import constants
+import coverstate
+import curtaincommands
+import curtainframes
+import gattcache
+import metrics
+import motionmodel
+import packetlog
 import slutils
 
 log = ulogging.getLogger(__name__)
 log.setLevel(ulogging.DEBUG)
 
+CACHED_HANDLES = "cached"
+DISCOVERED_HANDLES = "discovered"
+QUEUED_COMMAND_ORDER = (
+    curtaincommands.STOP_KIND,
+    curtaincommands.MOVE_KIND,
+    curtaincommands.FETCH_STATE_KIND,
+    curtaincommands.FETCH_ADVANCED_PAGE_KIND,
+)
+
 
 class BluetoothCover:
-    STATE_2_NAMES = [
-        ("is_solar_panel_connected", lambda bitStr: bitStr[0] == "1"),
-        ("is_calibrated", lambda bitStr: bitStr[1] == "1"),
-        ("motion_status",
-         lambda bitStr: constants.MOTIONS[int(bitStr[2:4], 2)]),
-    ]
-    NAMES = [
-        ("response_status", lambda byte_list: byte_list[0]),
-        ("battery_percentage", lambda byte_list: byte_list[1]),
-        ("firmware_version", lambda byte_list: byte_list[2]),
-        ("device_chain_length", lambda byte_list: byte_list[3]),
-        ("state_1", lambda byte_list: byte_list[4]),
-        ("state_2", lambda byte_list: BluetoothCover._names_to_map(
-            BluetoothCover.STATE_2_NAMES, BluetoothCover._byte_to_bin_str(byte_list[5]))),
-        ("position", lambda byte_list: byte_list[6]),
-        ("number_of_timers", lambda byte_list: byte_list[7]),
-    ]
-    ADV_NAMES = [
-        ("response_status", lambda byte_list: byte_list[0]),
-        ("battery_percentage", lambda byte_list: byte_list[1]),
-        ("firmware_version", lambda byte_list: byte_list[2]),
-        ("state_of_charge",
-         lambda byte_list: constants.STATES_OF_CHARGE[int(byte_list[3])]),
-    ]
-
-    def __init__(self, mac, on_state_updated_callback, on_last_command_successfull_callback, is_inverted=False):
+    def __init__(self, mac, on_state_updated_callback, on_last_command_successfull_callback, is_inverted=False, speed=curtaincommands.DEFAULT_SPEED,
+                 acknowledged_commands=constants.ACKNOWLEDGED_COMMANDS, on_connection_state_changed_callback=None,
+                 disconnected_command_policy=constants.DISCONNECTED_COMMAND_POLICY,
+                 on_demand=constants.ON_DEMAND_CONNECTION, keep_warm_ms=constants.KEEP_WARM_MS,
+                 connection_scheduler=None):
         self._on_state_updated_callback = on_state_updated_callback
         self._on_last_command_successfull_callback = on_last_command_successfull_callback
+        self._on_connection_state_changed_callback = on_connection_state_changed_callback
+        self._connection_state = connectionstate.ConnectionStateMachine(self._on_connection_state_changed)
+        self._connected_event = asyncio.Event()
+        self._connect_requested = asyncio.Event()
+        self._disconnect_requested = False
+        self._link_lost_ticks = None
+        self.link_loss_to_resubscribed = metrics.Histogram(constants.RECONNECT_BOUNDS_MS)
+        self._disconnected_command_policy = disconnected_command_policy
+        self._queued_commands = {}
+        self._on_demand = on_demand
+        self._connection_scheduler = connection_scheduler
+        self._keep_warm_ms = keep_warm_ms
+        self._last_activity = utime.ticks_ms()
+        self.connect_latency = metrics.Histogram()
+        self._requested_profile = None
+        self._profile = None
+        self.profile_connects = {}
+        self.profile_response_latency = {}
+        self._mac = mac
         self._device = aioble.Device(constants.ADDR_RANDOM, mac)
         self._write_characteristic = None
         self._notification_characteristic = None
+        self._notification_ring = None
+        if constants.NOTIFICATION_CAPTURE_FRAMES:
+            self._notification_ring = NotificationRing(
+                constants.NOTIFICATION_CAPTURE_FRAMES, constants.NOTIFICATION_FRAME_SIZE)
+        self.notification_batches = metrics.Histogram(constants.NOTIFICATION_BATCH_BOUNDS)
         self._connection = None
+        self._gatt_cache = gattcache.GattCache(mac)
+        self._connected = None
+        self.connect_to_first_command = {}
         self._state = None
         self._adv_state = None
+        self._status_frame = curtainframes.StatusFrame()
+        self._advanced_frame = curtainframes.AdvancedFrame()
+        self._last_status_frame = bytearray(curtainframes.STATUS_FRAME_LENGTH)
+        self._last_advanced_frame = bytearray(curtainframes.ADVANCED_FRAME_LENGTH)
+        self._status_changed = False
+        self._advanced_changed = False
+        self._snapshot = coverstate.EMPTY
+        self.packet_log = packetlog.PacketLog(
+            constants.PACKET_LOG_SIZE, constants.PACKET_LOG_FRAME_SIZE)
+        self._frame_registry = curtainframes.FrameRegistry()
+        self._frame_registry.register(
+            curtainframes.STATUS_FRAME_LENGTH, self._on_status_frame)
+        self._frame_registry.register(
+            curtainframes.ADVANCED_FRAME_LENGTH, self._on_advanced_frame)
         self._is_inverted = is_inverted
+        self._speed = speed
+        self._acknowledged_commands = acknowledged_commands
+        self._awaited_responses = []
+        self.ack_latency = {}
+        self.response_latency = {}
         self._is_moving = False
         self._just_started_moving = False
+        self._motion = motionmodel.MotionModel(slutils.read_calibration().get(mac))
+        self._poll_requested = asyncio.Event()
+        self._polls_this_move = 0
+        self.polls_per_move = metrics.Histogram(constants.POLLS_PER_MOVE_BOUNDS)
+        self._advertisement = curtainframes.AdvertisementFrame()
+        self._advertised_status_frame = bytearray(curtainframes.STATUS_FRAME_LENGTH)
+        self._advertised_advanced_frame = bytearray(curtainframes.ADVANCED_FRAME_LENGTH)
+        self._advertisement_ticks = None
+        self._advanced_page_ticks = None
+        self.advertisements = 0
+        self.skipped_polls = 0
 
     async def init(self):
-        await self.connect()
+        asyncio.get_event_loop().create_task(self._supervise())
+        # In on demand mode the first command or poll opens the connection.
+        if not self._on_demand:
+            await self.connect()
         await self.start_listening()
 
-    async def connect(self):
-        is_connected = False
-        self._on_last_command_successfull_callback(False)
-        while not is_connected:
+    async def connect(self, profile=None):
+        # The supervisor owns the connection, everyone else asks it to
+        # connect and waits for the result.
+        if self._connection_state.is_subscribed:
+            return True
+        self._request_profile(profile)
+        self._connect_requested.set()
+        try:
+            await asyncio.wait_for_ms(self._connected_event.wait(), constants.CONNECT_TIMEOUT_MS)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _supervise(self):
+        while True:
+            try:
+                await self._supervise_connection()
+            except Exception as e:  # type: ignore
+                # Nothing else reconnects this cover, so keep going.
+                log.exc(e, "Supervising the connection failed")
+                self._on_disconnected()
+                await asyncio.sleep_ms(self._connection_state.next_backoff_ms())
+
+    async def _supervise_connection(self):
+        if not self._connection_state.is_subscribed:
+            if self._on_demand or self._disconnect_requested:
+                await self._connect_requested.wait()
+            self._connect_requested.clear()
+            self._disconnect_requested = False
+            await self._establish_connection()
+            # Requests made while connecting are answered by this connect.
+            self._connect_requested.clear()
+            if self._link_lost_ticks is not None:
+                self.link_loss_to_resubscribed.record(
+                    utime.ticks_diff(utime.ticks_ms(), self._link_lost_ticks))
+                self._link_lost_ticks = None
+            await self._send_queued_commands()
+        try:
+            await self._connection.disconnected(timeout_ms=None)
+        except (Exception, OSError) as e:  # type: ignore
+            log.exc(e, "Waiting for disconnect failed")
+        self._on_disconnected()
+
+    async def _establish_connection(self):
+        while not self._connection_state.is_subscribed:
             try:
-                self._connection = await self._device.connect(timeout_ms=30000)
-                service = await self._connection.service(constants.DATA_SERVICE)
-                log.debug("Service: %s", service)
-                self._write_characteristic = await service.characteristic(constants.WRITE_CHAR)
-                log.debug("Write Char: %s", self._write_characteristic)
-                self._notification_characteristic = await service.characteristic(constants.NOTIFICATION_CHAR)
-                log.debug("Notification Char: %s",
-                          self._notification_characteristic)
-                await self._notification_characteristic.subscribe(notify=True)
-                is_connected = True
-                self._on_last_command_successfull_callback(True)
-            except (OSError, AttributeError) as e:  # type: ignore
+                connect_started = utime.ticks_ms()
+                self._connection_state.transition(connectionstate.CONNECTING)
+                if self._connection_scheduler:
+                    await self._connection_scheduler.acquire(self)
+                profile = self._next_profile()
+                self._connection = await self._connect_with_profile(profile)
+                self._profile = profile
+                self.profile_connects[profile] = self.profile_connects.get(profile, 0) + 1
+                self._connection_state.transition(connectionstate.DISCOVERING)
+                handles = CACHED_HANDLES
+                if not await self._subscribe_with_cached_handles():
+                    handles = DISCOVERED_HANDLES
+                    await self._discover_and_subscribe()
+                self._connected = (handles, connect_started)
+                self._connection_state.transition(connectionstate.SUBSCRIBED)
+                self.connect_latency.record(utime.ticks_diff(utime.ticks_ms(), connect_started))
+                self._last_activity = utime.ticks_ms()
+                self._requested_profile = None
+            except (OSError, AttributeError, ValueError, asyncio.TimeoutError,
+                    aioble.DeviceDisconnectedError, aioble.GattError) as e:  # type: ignore
+                # The link often drops during discovery, that is just another
+                # failed attempt.
                 log.exc(e, "failed to connect")
-                self._on_last_command_successfull_callback(False)
-                await asyncio.sleep(1)
+                await self._close_failed_connection()
+                self._release_connection_slot()
+                self._connection_state.transition(connectionstate.BACKOFF)
+                await asyncio.sleep_ms(self._connection_state.next_backoff_ms())
+
+    async def _close_failed_connection(self):
+        # A GATT error can leave the link up without subscriptions.
+        connection = self._connection
+        if connection is None or not connection.is_connected():
+            return
+        try:
+            await connection.disconnect()
+        except (Exception, OSError) as e:  # type: ignore
+            log.exc(e, "Closing the failed connection failed")
+
+    def _connect_with_profile(self, profile):
+        if profile not in constants.CONNECTION_PROFILES:
+            return self._device.connect(timeout_ms=constants.CONNECT_TIMEOUT_MS)
+        min_interval_us, max_interval_us = constants.CONNECTION_PROFILES[profile]
+        return self._device.connect(
+            timeout_ms=constants.CONNECT_TIMEOUT_MS,
+            min_conn_interval_us=min_interval_us,
+            max_conn_interval_us=max_interval_us)
+
+    def _next_profile(self):
+        # The port can't update the parameters of a live connection, so the
+        # profile is decided by what the connection is opened for. A link
+        # that stays open carries the moves too, so it keeps the stack's
+        # parameters instead of the power saving ones.
+        if not self._on_demand:
+            return constants.CONNECTED_CONNECTION_PROFILE
+        if self._requested_profile:
+            return self._requested_profile
+        if self._is_moving or curtaincommands.MOVE_KIND in self._queued_commands \
+                or curtaincommands.STOP_KIND in self._queued_commands:
+            return constants.MOVING_CONNECTION_PROFILE
+        return constants.IDLE_CONNECTION_PROFILE
+
+    def _request_profile(self, profile):
+        if profile and self._requested_profile != constants.MOVING_CONNECTION_PROFILE:
+            self._requested_profile = profile
+
+    @staticmethod
+    def _profile_for(kind):
+        if kind in (curtaincommands.MOVE_KIND, curtaincommands.STOP_KIND):
+            return constants.MOVING_CONNECTION_PROFILE
+        return constants.IDLE_CONNECTION_PROFILE
+
+    def _on_disconnected(self):
+        if self._connection_state.is_subscribed and not self._disconnect_requested:
+            self._link_lost_ticks = utime.ticks_ms()
+        self._connection_state.transition(connectionstate.IDLE)
+        self._release_connection_slot()
+
+    def _release_connection_slot(self):
+        if self._connection_scheduler:
+            self._connection_scheduler.release(self)
+
+    def _on_connection_state_changed(self, previous, state):
+        log.info("Connection %s -> %s", previous, state)
+        if state == connectionstate.SUBSCRIBED:
+            self._connected_event.set()
+        else:
+            self._connected_event.clear()
+        if self._on_connection_state_changed_callback:
+            self._on_connection_state_changed_callback(previous, state)
+
+    async def _subscribe_with_cached_handles(self):
+        if not self._gatt_cache.is_cached:
+            return False
+        self._write_characteristic, self._notification_characteristic = \
+            self._gatt_cache.characteristics(self._connection)
+        self._capture_notifications()
+        try:
+            await self._notification_characteristic.subscribe(
+                notify=True, cccd_handle=self._gatt_cache.cccd_handle)
+            return True
+        except aioble.GattError as e:  # type: ignore
+            log.exc(e, "Cached GATT handles rejected, rediscovering")
+            self._gatt_cache.invalidate()
+            return False
+
+    async def _discover_and_subscribe(self):
+        service = await self._connection.service(constants.DATA_SERVICE)
+        log.debug("Service: %s", service)
+        self._write_characteristic = await service.characteristic(constants.WRITE_CHAR)
+        log.debug("Write Char: %s", self._write_characteristic)
+        self._notification_characteristic = await service.characteristic(constants.NOTIFICATION_CHAR)
+        log.debug("Notification Char: %s",
+                  self._notification_characteristic)
+        self._capture_notifications()
+        await self._notification_characteristic.subscribe(notify=True)
+        self._gatt_cache.store(
+            service, self._write_characteristic, self._notification_characteristic)
+
+    def _capture_notifications(self):
+        if self._notification_ring is not None:
+            self._notification_characteristic.capture(self._notification_ring)
 
     async def start_listening(self):
         async def _listen_for_notifications():
             while True:
                 try:
-                    if self._notification_characteristic:
-                        notification = await self._notification_characteristic.notified()
-                        log.debug("notification %s", notification)
-                        output = ""
-                        for abyte in notification:
-                            hexvalue = f"{abyte:x}"
-                            hexvalue = f"{hexvalue:0>2}-"
-                            output += hexvalue
-                        log.debug("notification %s", output[:-1])
-                        self._on_notification(notification)
-                        if self._just_started_moving:
-                            self._just_started_moving = False
+                    if self._connection_state.is_subscribed:
+                        if self._notification_ring is not None:
+                            # One wake-up handles every frame of a burst.
+                            handled = await self._notification_characteristic.notified_batch(
+                                self._on_received)
+                            self.notification_batches.record(handled)
+                        else:
+                            self._on_received(await self._notification_characteristic.notified())
                         self._on_last_command_successfull_callback(True)
                     else:
-                        await asyncio.sleep(1)
+                        await self._connected_event.wait()
                 except aioble.DeviceDisconnectedError as e:  # type: ignore
+                    # The supervisor reconnects, just stop reading until then.
                     log.exc(e, "Disconnected")
-                    await self.connect()
+                    self._on_disconnected()
                 except (Exception, OSError) as e:  # type: ignore
                     log.exc(e, "Listening failed")
                     self._on_last_command_successfull_callback(False)
@@ -105,65 +307,136 @@ class BluetoothCover:
         asyncio.get_event_loop().create_task(_listen_for_notifications())
 
         async def _send_fetch_state():
-            counter = constants.PERIODS_TO_WAIT_IN_STANDBY
+            if not self._connection_scheduler:
+                await self._fetch_state()
             while True:
-                if self._is_moving or counter == constants.PERIODS_TO_WAIT_IN_STANDBY:
-                    await self._fetch_state()
-                    counter = -1
-                counter += 1
-                await asyncio.sleep(constants.TIME_TO_WAIT_WHILE_MOVING)
+                if self._is_moving:
+                    delay_ms = self._motion.next_poll_ms()
+                elif self._connection_scheduler:
+                    # The scheduler runs the standby polls, wait for a move.
+                    delay_ms = None
+                else:
+                    delay_ms = self._standby_poll_ms
+                if await self._wait_for_poll_request(delay_ms):
+                    # Motion changed, so work out a new poll time.
+                    continue
+                if self._is_moving:
+                    self._polls_this_move += 1
+                elif self._has_fresh_advertisement:
+                    self.skipped_polls += 1
+                    continue
+                await self._fetch_state()
+                if self._on_demand and not self._is_moving:
+                    # Share the connection instead of waking up separately.
+                    await self._fetch_advanced_page()
 
         asyncio.get_event_loop().create_task(_send_fetch_state())
 
         async def _send_adv_fetch_state():
             await asyncio.sleep(constants.PERIODS_TO_WAIT_IN_STANDBY / 2)
             while True:
-                await self._send_command(constants.FETCH_ADVANCED_PAGE_COMMAND)
+                if self._needs_advanced_page:
+                    await self._fetch_advanced_page()
+                else:
+                    self.skipped_polls += 1
                 await asyncio.sleep(constants.PERIODS_TO_WAIT_IN_STANDBY)
 
-        asyncio.get_event_loop().create_task(_send_adv_fetch_state())
+        async def _keep_warm():
+            while True:
+                idle_ms = utime.ticks_diff(utime.ticks_ms(), self._last_activity)
+                if idle_ms >= self._keep_warm_ms and not self._is_moving \
+                        and self._connection_state.is_subscribed:
+                    log.debug("Idle for %s ms, disconnecting", idle_ms)
+                    await self.disconnect()
+                    idle_ms = 0
+                await asyncio.sleep_ms(max(self._keep_warm_ms - idle_ms, constants.MIN_POLL_INTERVAL_MS))
+
+        if self._on_demand:
+            asyncio.get_event_loop().create_task(_keep_warm())
+        elif not self._connection_scheduler:
+            asyncio.get_event_loop().create_task(_send_adv_fetch_state())
+
+    async def poll(self):
+        # A standby poll on behalf of the connection scheduler, returns
+        # whether anything was sent.
+        polled = False
+        if not self._has_fresh_advertisement:
+            await self._fetch_state()
+            polled = True
+        if self._needs_advanced_page:
+            await self._fetch_advanced_page()
+            polled = True
+        if not polled:
+            self.skipped_polls += 1
+        return polled
 
     async def disconnect(self):
         if self._connection:
-            self._connection.disconnect()
+            # Leave the subscribed state first so nothing writes to the
+            # connection that is going away.
+            self._disconnect_requested = True
+            self._on_disconnected()
+            await self._connection.disconnect()
 
     async def move_to(self, pos):
         pos = self._invert_if_needed(pos)
         log.debug("Moving curtain to %s", pos)
-        await self._send_command(self._new_pos_command(self._invert_if_needed(pos)))
-        self._is_moving = True
-        self._just_started_moving = True
+        target = self._invert_if_needed(pos)
+        return await self._send_command(
+            curtaincommands.move_to(target, self._speed), curtaincommands.MOVE_KIND, target)
 
     async def close(self):
-        await self.move_to(self._invert_if_needed(0))
+        return await self.move_to(self._invert_if_needed(0))
 
     async def open(self):
-        await self.move_to(self._invert_if_needed(100))
+        return await self.move_to(self._invert_if_needed(100))
 
     async def stop(self):
-        await self._send_command(constants.STOP_STATE_COMMAND)
+        return await self._send_command(curtaincommands.stop(), curtaincommands.STOP_KIND)
+
+    def _on_command_written(self, kind, target):
+        # The motion model only follows commands that reached the curtain.
+        if kind == curtaincommands.MOVE_KIND:
+            self._is_moving = True
+            self._just_started_moving = True
+            self._polls_this_move = 0
+            self._motion.start(target)
+            self._poll_requested.set()
+        elif kind == curtaincommands.STOP_KIND and self._is_moving:
+            self._motion.start(None)
+            self._poll_requested.set()
+
+    @property
+    def snapshot(self):
+        return self._snapshot
 
     @property
     def state(self):
-        if self.has_state:
-            flattened = slutils.flatten_dict(self._state)
-            flattened["position"] = self.position
-            flattened["state_2.motion_status"] = self._invert_motions_if_needed(
-                flattened["state_2.motion_status"])
-            return flattened
-        return None
+        return self._snapshot.state
 
     @property
     def adv_state(self):
-        if self.has_adv_state:
-            flattened = slutils.flatten_dict(self._adv_state)
-            flattened["is_adapter_connect"] = self.is_adapter_plugged_in
-            return flattened
-        return None
+        return self._snapshot.adv_state
 
     @property
     def position(self):
-        return self._invert_if_needed(self._get_result_or_default("position", None))
+        return self._snapshot.position
+
+    @property
+    def is_moving(self):
+        return self._is_moving
+
+    @property
+    def predicted_position(self):
+        return self._invert_if_needed(self._motion.predicted_position())
+
+    @property
+    def eta_ms(self):
+        return self._motion.remaining_ms()
+
+    @property
+    def prediction_error(self):
+        return self._motion.prediction_error
 
     @property
     def is_closed(self):
@@ -171,28 +444,16 @@ class BluetoothCover:
 
     @property
     def motion_status(self):
-        if self.state:
-            if "state_2.motion_status" in self.state:
-                motion_status = self.state["state_2.motion_status"]
-                if motion_status == "static":
-                    return "closed" if self.is_closed else "open"
-                return motion_status
-        return None
+        return self._snapshot.motion_status
 
     @property
     def battery(self):
-        if self.has_adv_state:
-            if "battery_percentage" in self._adv_state:
-                battery_percentage = self._adv_state["battery_percentage"]
-                return battery_percentage
-        return None
+        return self._snapshot.battery
 
     @property
     def is_adapter_plugged_in(self):
         if self.has_adv_state:
-            if "state_of_charge" in self._adv_state:
-                state_of_charge = self._adv_state["state_of_charge"]
-                return "adapter" in state_of_charge
+            return self._adv_state.is_adapter_plugged_in
         return None
 
     @property
@@ -203,69 +464,278 @@ class BluetoothCover:
     def has_adv_state(self):
         return self._adv_state is not None
 
-    async def _send_command(self, command):
+    def latency_stats(self):
+        return {
+            "ack": {kind: histogram.to_dict() for kind, histogram in self.ack_latency.items()},
+            "response": {kind: histogram.to_dict() for kind, histogram in self.response_latency.items()},
+            "response_by_profile": {
+                profile: histogram.to_dict() for profile, histogram in self.profile_response_latency.items()},
+            "connect_to_first_command": {
+                handles: histogram.to_dict() for handles, histogram in self.connect_to_first_command.items()},
+        }
+
+    def connection_stats(self):
+        stats = self._connection_state.stats()
+        stats["connect_latency"] = self.connect_latency.to_dict()
+        stats["link_loss_to_resubscribed"] = self.link_loss_to_resubscribed.to_dict()
+        stats["profile"] = self._profile
+        stats["profile_connects"] = self.profile_connects
+        return stats
+
+    def _hold_command(self, command, kind, target=None):
+        if self._disconnected_command_policy == connectionstate.QUEUE:
+            # Keep the newest command of each kind, a stop replaces a queued
+            # move and the other way around.
+            if kind == curtaincommands.STOP_KIND:
+                self._queued_commands.pop(curtaincommands.MOVE_KIND, None)
+            elif kind == curtaincommands.MOVE_KIND:
+                self._queued_commands.pop(curtaincommands.STOP_KIND, None)
+            self._queued_commands[kind] = (command, target)
+            log.debug("Queued %s while disconnected", kind)
+            self._request_profile(self._profile_for(kind))
+            self._connect_requested.set()
+        else:
+            log.warning("Rejected %s while disconnected", kind)
+            self._on_last_command_successfull_callback(False)
+
+    async def _send_queued_commands(self):
+        for kind in QUEUED_COMMAND_ORDER:
+            queued = self._queued_commands.pop(kind, None)
+            if queued is not None:
+                await self._send_command(queued[0], kind, queued[1])
+
+    @property
+    def on_demand(self):
+        return self._on_demand
+
+    @property
+    def addr(self):
+        return self._device.addr
+
+    @property
+    def is_subscribed(self):
+        return self._connection_state.is_subscribed
+
+    @property
+    def last_activity(self):
+        return self._last_activity
+
+    @property
+    def _needs_advanced_page(self):
+        # Battery comes with the advertisements, only the charge state needs
+        # the occasional fetch.
+        return not self._has_fresh_advertisement or self._advanced_page_ticks is None or utime.ticks_diff(
+            utime.ticks_ms(), self._advanced_page_ticks) >= constants.ADVERTISED_ADVANCED_PAGE_INTERVAL_MS
+
+    @property
+    def _has_fresh_advertisement(self):
+        return self._advertisement_ticks is not None and utime.ticks_diff(
+            utime.ticks_ms(), self._advertisement_ticks) < constants.ADVERTISEMENT_FRESH_MS
+
+    @property
+    def _standby_poll_ms(self):
+        if self._on_demand:
+            return constants.ON_DEMAND_STANDBY_POLL_INTERVAL_MS
+        return constants.PERIODS_TO_WAIT_IN_STANDBY * 1000
+
+    async def _send_command(self, command, kind, target=None):
+        # Returns the ticks_us the write started and finished at, or None
+        # when the command was held or failed.
+        if not self._connection_state.is_subscribed and self._on_demand:
+            await self.connect(self._profile_for(kind))
+        if not self._connection_state.is_subscribed:
+            self._hold_command(command, kind, target)
+            return
+        self._last_activity = utime.ticks_ms()
+        awaited = None
         try:
-            if self._write_characteristic:
-                await self._write_characteristic.write(command)
-                log.debug("Sent command: %s", command)
-                self._on_last_command_successfull_callback(True)
+            self.packet_log.record(packetlog.TX, command)
+            acknowledged = kind in self._acknowledged_commands
+            sent_at = utime.ticks_ms()
+            # The response can arrive before an acknowledged write returns.
+            awaited = (kind, sent_at)
+            self._await_response(awaited)
+            write_started_us = utime.ticks_us()
+            await self._write_characteristic.write(command, acknowledged)
+            write_done_us = utime.ticks_us()
+            if acknowledged:
+                self._record_latency(self.ack_latency, kind, sent_at)
+            log.debug("Sent command: %s", bytes(command))
+            self._on_last_command_successfull_callback(True)
+            awaited = None
+            if self._connected:
+                handles, connect_started = self._connected
+                self._connected = None
+                self._record_latency(self.connect_to_first_command, handles, connect_started)
+            self._on_command_written(kind, target)
+            return write_started_us, write_done_us
         except TypeError as e:
-            log.exc(e, "Send command failed: %s", command)
-            await self.connect()
+            # Writing on a dropped connection fails with a TypeError.
+            log.exc(e, "Send command failed: %s", bytes(command))
+            self._on_disconnected()
+            self._hold_command(command, kind, target)
+        except aioble.GattError as e:  # type: ignore
+            log.exc(e, "Send command failed: %s", bytes(command))
+            self._on_last_command_successfull_callback(False)
+            # The handles may be stale, discover them again on the next connect.
+            self._gatt_cache.invalidate()
         except (Exception, OSError) as e:  # type: ignore
-            log.exc(e, "Send command failed: %s", command)
+            log.exc(e, "Send command failed: %s", bytes(command))
             self._on_last_command_successfull_callback(False)
         except:  # pylint: disable=bare-except
-            log.error("Send command failed: %s", command)
+            log.error("Send command failed: %s", bytes(command))
             self._on_last_command_successfull_callback(False)
+        finally:
+            if awaited in self._awaited_responses:
+                self._awaited_responses.remove(awaited)
+
+    async def _wait_for_poll_request(self, delay_ms):
+        self._poll_requested.clear()
+        if delay_ms is None:
+            await self._poll_requested.wait()
+            return True
+        try:
+            await asyncio.wait_for_ms(self._poll_requested.wait(), delay_ms)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _await_response(self, awaited):
+        if len(self._awaited_responses) >= constants.MAX_AWAITED_RESPONSES:
+            # The oldest command never got a response.
+            self._awaited_responses.pop(0)
+        self._awaited_responses.append(awaited)
+
+    def _on_response(self):
+        if self._awaited_responses:
+            kind, sent_at = self._awaited_responses.pop(0)
+            self._record_latency(self.response_latency, kind, sent_at)
+            self._record_latency(self.profile_response_latency, self._profile, sent_at)
+
+    @staticmethod
+    def _record_latency(histograms, kind, sent_at):
+        if kind not in histograms:
+            histograms[kind] = metrics.Histogram()
+        histograms[kind].record(utime.ticks_diff(utime.ticks_ms(), sent_at))
+
+    def register_frame_handler(self, length, handler, header=curtainframes.RESPONSE_OK):
+        self._frame_registry.register(length, handler, header)
+
+    def _on_received(self, notification):
+        self._last_activity = utime.ticks_ms()
+        self.packet_log.record(packetlog.RX, notification)
+        self._on_response()
+        self._on_notification(notification)
+        if self._just_started_moving:
+            self._just_started_moving = False
+
+    def notification_stats(self):
+        ring = self._notification_ring
+        if ring is None:
+            return None
+        return {
+            "captured": ring.captured,
+            "dropped": ring.dropped,
+            "overflows": ring.overflows,
+            "batches": self.notification_batches.to_dict(),
+        }
 
     def _on_notification(self, notification):
-        if ",\\" in f"{notification}":
-            notification = self._pad_bytes(bytearray(notification))
-            if "x\\" in f"{notification}":
-                self._state = BluetoothCover._names_to_map(
-                    BluetoothCover.NAMES, notification)
-                if not self._just_started_moving and self._state["state_2"]["motion_status"] == "static":
-                    self._is_moving = False
-                log.debug("State: %s", self._state)
-            else:
-                self._adv_state = BluetoothCover._names_to_map(
-                    BluetoothCover.ADV_NAMES, notification)
-                log.debug("ADV State: %s", self._adv_state)
-            self._on_state_updated_callback(self)
-
-    def _pad_bytes(self, abytes):
-        bytes_to_add = 8 - len(abytes)
-        for _ in range(bytes_to_add):
-            abytes.append(0)
-        return abytes
+        if self._frame_registry.dispatch(notification):
+            snapshot = self._take_snapshot()
+            changed = coverstate.changed_fields(self._snapshot, snapshot)
+            self._snapshot = snapshot
+            self._on_state_updated_callback(snapshot, changed)
+
+    def on_advertisement(self, service_data, manufacturer_data=None):
+        advertisement = self._advertisement.decode(service_data, manufacturer_data)
+        if advertisement is None:
+            return
+        self.advertisements += 1
+        self._advertisement_ticks = utime.ticks_ms()
+        # Turn the advertisement into the frames a fetch would have returned,
+        # so it goes through the same change detection and motion tracking.
+        self._advertised_status_frame[:] = self._last_status_frame
+        advertisement.patch_status_frame(
+            self._advertised_status_frame, self._advertised_motion(advertisement))
+        self._on_notification(self._advertised_status_frame)
+        if self.has_adv_state:
+            self._advertised_advanced_frame[:] = self._last_advanced_frame
+            advertisement.patch_advanced_frame(self._advertised_advanced_frame)
+            self._on_notification(self._advertised_advanced_frame)
+
+    def _advertised_motion(self, advertisement):
+        if not advertisement.is_in_motion:
+            return 0
+        previous = self._state.position if self.has_state else advertisement.position
+        if advertisement.position == previous:
+            increasing = self._motion.direction == motionmodel.INCREASING
+        else:
+            increasing = advertisement.position > previous
+        # Status frames count positions up while closing.
+        return constants.MOTIONS.index("closing" if increasing else "opening")
+
+    def _on_status_frame(self, frame):
+        self._status_changed = self._last_status_frame != frame
+        if self._status_changed:
+            self._last_status_frame[:] = frame
+        self._state = self._status_frame.decode(frame)
+        self._motion.update(self._state.position)
+        if self._is_moving and not self._just_started_moving and self._state.motion_status == "static":
+            self._is_moving = False
+            self._motion.stop()
+            self.polls_per_move.record(self._polls_this_move)
+            self._poll_requested.set()
+            if self._motion.needs_saving:
+                self._save_speeds()
+
+    def _on_advanced_frame(self, frame):
+        self._advanced_changed = self._last_advanced_frame != frame
+        if self._advanced_changed:
+            self._last_advanced_frame[:] = frame
+        self._adv_state = self._advanced_frame.decode(frame)
+
+    def _take_snapshot(self):
+        previous = self._snapshot
+        position = previous.position
+        motion_status = previous.motion_status
+        state = previous.state
+        battery = previous.battery
+        adv_state = previous.adv_state
+        if self._status_changed:
+            self._status_changed = False
+            position = self._invert_if_needed(self._state.position)
+            state = self._state.to_dict()
+            state["position"] = position
+            state["eta_ms"] = self._motion.remaining_ms() if self._is_moving else None
+            state["state_2.motion_status"] = self._invert_motions_if_needed(
+                state["state_2.motion_status"])
+            motion_status = state["state_2.motion_status"]
+            if motion_status == "static":
+                motion_status = "closed" if position < 5 else "open"
+        if self._advanced_changed:
+            self._advanced_changed = False
+            battery = self._adv_state.battery_percentage
+            adv_state = self._adv_state.to_dict()
+            adv_state["is_adapter_connect"] = self._adv_state.is_adapter_plugged_in
+        return coverstate.CoverSnapshot(position, motion_status, state, battery, adv_state)
+
+    def _save_speeds(self):
+        try:
+            calibration = slutils.read_calibration()
+            calibration[self._mac] = self._motion.speeds
+            slutils.write_calibration(calibration)
+            self._motion.mark_saved()
+        except OSError as e:  # type: ignore
+            log.exc(e, "Saving curtain speeds failed")
 
     async def _fetch_state(self):
-        await self._send_command(constants.FETCH_STATE_COMMAND)
-
-    def _get_result_or_default(self, result_name, default):
-        if self.has_state:
-            if result_name in self._state:
-                return self._state[result_name]
-        return default
-
-    def _new_pos_command(self, pos):
-        data = bytearray(b'\x57\x0F\x45\x01\x05\xFF')
-        data.append(pos)
-        return data
+        await self._send_command(curtaincommands.FETCH_STATE, curtaincommands.FETCH_STATE_KIND)
 
-    @staticmethod
-    def _byte_to_bin_str(byte):
-        bin_value = f"{byte:b}"
-        bin_value = f"{bin_value:0>4}"
-        return bin_value
-
-    @staticmethod
-    def _names_to_map(names, value):
-        result = {}
-        for name in names:
-            result[name[0]] = name[1](value)
-        return result
+    async def _fetch_advanced_page(self):
+        self._advanced_page_ticks = utime.ticks_ms()
+        await self._send_command(
+            curtaincommands.FETCH_ADVANCED_PAGE, curtaincommands.FETCH_ADVANCED_PAGE_KIND)
 
     def _invert_if_needed(self, position):
         if self._is_inverted and position is not None:
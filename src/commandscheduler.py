@@ -0,0 +1,142 @@
+import uasyncio as asyncio
+import ulogging
+import utime
+
+import constants
+
+log = ulogging.getLogger(__name__)
+log.setLevel(ulogging.DEBUG)
+
+MOVE = "move"
+OPEN = "open"
+CLOSE = "close"
+STOP = "stop"
+
+
+class CommandScheduler:
+    def __init__(self, cover, duplicate_window_ms=constants.DUPLICATE_COMMAND_WINDOW_MS):
+        self._cover = cover
+        self._duplicate_window_ms = duplicate_window_ms
+        self._pending = None
+        self._in_flight = None
+        self._last_sent = None
+        self._last_sent_ticks = 0
+        self._draining = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # Bumped whenever a command becomes the newest intent.
+        self._intents = 0
+        self.submitted = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def move_to(self, position):
+        self._submit((MOVE, position))
+
+    def open(self):
+        self._submit((OPEN, None))
+
+    def close(self):
+        self._submit((CLOSE, None))
+
+    def stop(self):
+        self._submit((STOP, None))
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }
+
+    def _submit(self, command):
+        self.submitted += 1
+        if self._is_duplicate(command):
+            self.dropped += 1
+            log.debug("Dropped duplicate command %s", command)
+            return
+        if self._pending is not None:
+            # Only one command waits behind the one in flight: the newest
+            # target wins, and a STOP always replaces a pending move.
+            self.coalesced += 1
+            log.debug("Coalesced %s into %s", self._pending, command)
+        self._pending = command
+        self._intents += 1
+        if not self._draining:
+            self._set_draining(True)
+            asyncio.get_event_loop().create_task(self._drain())
+
+    async def run(self, command):
+        # Runs command in the caller's task, for group moves that need the
+        # result of the write. It replaces the pending command and waits for
+        # the one in flight, so neither can land after it. Returns None if a
+        # newer command arrived while waiting.
+        self.submitted += 1
+        self._intents += 1
+        intent = self._intents
+        if self._pending is not None:
+            self.coalesced += 1
+            self._pending = None
+        while self._draining:
+            await self._idle.wait()
+        if self._intents != intent:
+            self.dropped += 1
+            return None
+        self._set_draining(True)
+        try:
+            result = await self._run_one(command)
+        finally:
+            self._set_draining(False)
+        if self._pending is not None:
+            self._set_draining(True)
+            asyncio.get_event_loop().create_task(self._drain())
+        return result
+
+    def _set_draining(self, draining):
+        self._draining = draining
+        if draining:
+            self._idle.clear()
+        else:
+            self._idle.set()
+
+    def _is_duplicate(self, command):
+        # Only compare with the newest intent: 50, 30, 50 must end at 50.
+        if self._pending is not None:
+            return command == self._pending
+        if self._in_flight is not None:
+            return command == self._in_flight
+        return command == self._last_sent and utime.ticks_diff(
+            utime.ticks_ms(), self._last_sent_ticks) < self._duplicate_window_ms
+
+    async def _drain(self):
+        try:
+            while self._pending is not None:
+                command = self._pending
+                self._pending = None
+                await self._run_one(command)
+        finally:
+            self._set_draining(False)
+
+    async def _run_one(self, command):
+        self._in_flight = command
+        try:
+            result = await self._execute(command)
+        finally:
+            self._in_flight = None
+        self.sent += 1
+        self._last_sent = command
+        self._last_sent_ticks = utime.ticks_ms()
+        return result
+
+    async def _execute(self, command):
+        kind, position = command
+        if kind == MOVE:
+            return await self._cover.move_to(position)
+        elif kind == OPEN:
+            return await self._cover.open()
+        elif kind == CLOSE:
+            return await self._cover.close()
+        elif kind == STOP:
+            return await self._cover.stop()
@@ -0,0 +1,110 @@
+import uasyncio as asyncio
+import ulogging
+import utime
+
+import constants
+import metrics
+
+log = ulogging.getLogger(__name__)
+log.setLevel(ulogging.DEBUG)
+
+
+class _PollRecord:
+    def __init__(self):
+        self.polls = 0
+        self.skipped = 0
+        self.first_ticks = None
+        self.last_ticks = None
+        self.interval = metrics.Histogram(constants.POLL_INTERVAL_BOUNDS_MS)
+
+    def record(self, polled):
+        if not polled:
+            self.skipped += 1
+            return
+        now = utime.ticks_ms()
+        if self.last_ticks is None:
+            self.first_ticks = now
+        else:
+            self.interval.record(utime.ticks_diff(now, self.last_ticks))
+        self.last_ticks = now
+        self.polls += 1
+
+    def to_dict(self):
+        rate = None
+        if self.polls > 1:
+            elapsed = utime.ticks_diff(self.last_ticks, self.first_ticks)
+            if elapsed > 0:
+                rate = round((self.polls - 1) * 3600000 / elapsed, 1)
+        return {
+            "polls": self.polls,
+            "skipped": self.skipped,
+            "polls_per_hour": rate,
+            "interval": self.interval.to_dict(),
+        }
+
+
+class ConnectionScheduler:
+    def __init__(self, max_connections=constants.MAX_BLE_CONNECTIONS,
+                 poll_interval_ms=constants.PERIODS_TO_WAIT_IN_STANDBY * 1000):
+        self._max_connections = max_connections
+        self._poll_interval_ms = poll_interval_ms
+        self._covers = []
+        self._holders = []
+        self._slot_freed = asyncio.Event()
+        self._records = {}
+        self.slot_waits = 0
+        self.evictions = 0
+
+    def add(self, name, cover):
+        self._covers.append((name, cover))
+        self._records[name] = _PollRecord()
+
+    async def acquire(self, cover):
+        if cover in self._holders:
+            return
+        if len(self._holders) >= self._max_connections:
+            self.slot_waits += 1
+        while len(self._holders) >= self._max_connections:
+            self._evict_idle_holder()
+            self._slot_freed.clear()
+            await self._slot_freed.wait()
+        self._holders.append(cover)
+
+    def release(self, cover):
+        if cover in self._holders:
+            self._holders.remove(cover)
+            self._slot_freed.set()
+
+    def _evict_idle_holder(self):
+        # Free the slot of the on demand cover that has been quiet the
+        # longest, always connected covers would reconnect straight away.
+        oldest = None
+        for holder in self._holders:
+            if holder.on_demand and holder.is_subscribed and not holder.is_moving:
+                if oldest is None or utime.ticks_diff(holder.last_activity, oldest.last_activity) < 0:
+                    oldest = holder
+        if oldest:
+            self.evictions += 1
+            log.debug("Freeing the connection of %s", oldest.addr)
+            asyncio.get_event_loop().create_task(oldest.disconnect())
+
+    async def run(self):
+        # Standby polls go round robin so connects never pile up, covers
+        # that are moving poll themselves.
+        while True:
+            started = utime.ticks_ms()
+            for name, cover in self._covers:
+                if not cover.is_moving:
+                    self._records[name].record(await cover.poll())
+            elapsed = utime.ticks_diff(utime.ticks_ms(), started)
+            await asyncio.sleep_ms(max(self._poll_interval_ms - elapsed, constants.MIN_POLL_INTERVAL_MS))
+
+    def stats(self):
+        return {
+            "max_connections": self._max_connections,
+            "connected": len(self._holders),
+            "slot_waits": self.slot_waits,
+            "evictions": self.evictions,
+            "poll_interval_ms": self._poll_interval_ms,
+            "devices": {name: record.to_dict() for name, record in self._records.items()},
+        }
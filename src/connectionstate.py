@@ -0,0 +1,63 @@
+import random
+import utime
+
+import constants
+
+IDLE = "idle"
+CONNECTING = "connecting"
+DISCOVERING = "discovering"
+SUBSCRIBED = "subscribed"
+BACKOFF = "backoff"
+STATES = (IDLE, CONNECTING, DISCOVERING, SUBSCRIBED, BACKOFF)
+
+QUEUE = "queue"
+REJECT = "reject"
+
+
+class ConnectionStateMachine:
+    def __init__(self, on_state_changed=None,
+                 backoff_initial_ms=constants.BACKOFF_INITIAL_MS,
+                 backoff_max_ms=constants.BACKOFF_MAX_MS):
+        self._on_state_changed = on_state_changed
+        self._backoff_initial_ms = backoff_initial_ms
+        self._backoff_max_ms = backoff_max_ms
+        self._attempts = 0
+        self.state = IDLE
+        self._entered = utime.ticks_ms()
+        self.time_in_state_ms = {state: 0 for state in STATES}
+        self.transitions = 0
+
+    @property
+    def is_subscribed(self):
+        return self.state == SUBSCRIBED
+
+    def transition(self, state):
+        if state == self.state:
+            return
+        now = utime.ticks_ms()
+        previous = self.state
+        self.time_in_state_ms[previous] += utime.ticks_diff(now, self._entered)
+        self._entered = now
+        self.state = state
+        self.transitions += 1
+        if state == SUBSCRIBED:
+            self._attempts = 0
+        if self._on_state_changed:
+            self._on_state_changed(previous, state)
+
+    def next_backoff_ms(self):
+        # Exponential backoff with "equal jitter": half of the delay is fixed,
+        # the other half random, so retries from several hubs spread out.
+        delay = min(self._backoff_max_ms, self._backoff_initial_ms << min(self._attempts, 16))
+        self._attempts += 1
+        half = delay // 2
+        return half + half * random.getrandbits(16) // 0xFFFF
+
+    def stats(self):
+        time_in_state_ms = dict(self.time_in_state_ms)
+        time_in_state_ms[self.state] += utime.ticks_diff(utime.ticks_ms(), self._entered)
+        return {
+            "state": self.state,
+            "transitions": self.transitions,
+            "time_in_state_ms": time_in_state_ms,
+        }
@@ -6,63 +6,10 @@ import machine
 import ubinascii
 
 CLIENT_ID = ubinascii.hexlify(machine.unique_id()).decode('utf-8')
-DISCOVERY_TOPIC = f"homeassistant/cover/{CLIENT_ID}/cover/config"
-BATTERY_DISCOVERY_TOPIC = f"homeassistant/sensor/{CLIENT_ID}/sensor/config"
-ATTRIBUTES_TOPIC = f"esp32/{CLIENT_ID}/cover/attributes"
-BATTERY_ATTRIBUTES_TOPIC = f"esp32/{CLIENT_ID}/battery/attributes"
-BATTERY_STATE_TOPIC = f"esp32/{CLIENT_ID}/battery/state"
-POSITION_TOPIC = f"esp32/{CLIENT_ID}/cover/position"
-STATE_TOPIC = f"esp32/{CLIENT_ID}/cover/state"
-SET_POSITION_TOPIC = f"esp32/{CLIENT_ID}/cover/set_position"
-SET_COMMAND_TOPIC = f"esp32/{CLIENT_ID}/cover/set"
 ESP_AVAILIBILITY_TOPIC = f"esp32/{CLIENT_ID}/esp_availibility"
-COVER_AVAILIBILITY_TOPIC = f"esp32/{CLIENT_ID}/cover_availibility"
-MQTT_DEVICE = {
-    "identifiers": [f"esp32_{CLIENT_ID}"],
-    "manufacturer": "blackstardlb",
-    "model": "esp32 switch bot cover hub",
-    "name": "Switch Bot Curtain"
-}
-MQTT_DISCOVERY_DATA = {
-    "availability": [
-        {
-            "topic": ESP_AVAILIBILITY_TOPIC
-        },
-        {
-            "topic": COVER_AVAILIBILITY_TOPIC
-        }
-    ],
-    "availability_mode": "all",
-    "device_class": "curtain",
-    "command_topic": SET_COMMAND_TOPIC,
-    "state_topic": STATE_TOPIC,
-    "position_topic": POSITION_TOPIC,
-    "set_position_topic": SET_POSITION_TOPIC,
-    "device": MQTT_DEVICE,
-    "json_attributes_topic":  ATTRIBUTES_TOPIC,
-    "name": "Switch Bot Curtain",
-    "optimistic": "false",
-    "unique_id": f"{CLIENT_ID}_light_esp32"
-}
-MQTT_BATTERY_DISCOVERY_DATA = {
-    "availability": [
-        {
-            "topic": ESP_AVAILIBILITY_TOPIC
-        },
-        {
-            "topic": COVER_AVAILIBILITY_TOPIC
-        }
-    ],
-    "availability_mode": "all",
-    "device_class": "battery",
-    "device": MQTT_DEVICE,
-    "json_attributes_topic":  BATTERY_ATTRIBUTES_TOPIC,
-    "state_topic": BATTERY_STATE_TOPIC,
-    "name": "Switch Bot Curtain Battery",
-    "optimistic": "false",
-    "unique_id": f"{CLIENT_ID}_battery_esp32",
-    "unit_of_measurement": "%"
-}
+DIAGNOSTICS_COMMAND_TOPIC = f"esp32/{CLIENT_ID}/hub/diagnostics/set"
+STATS_DIAGNOSTICS_TOPIC = f"esp32/{CLIENT_ID}/hub/diagnostics/stats"
+DEFAULT_CURTAIN_NAME = "Switch Bot Curtain"
 MOTIONS = [
     "static",
     "closing",
@@ -78,11 +25,62 @@ STATES_OF_CHARGE = [
     "charging_error",
 ]
 
-FETCH_STATE_COMMAND = bytearray(b'\x57\x02')
-FETCH_ADVANCED_PAGE_COMMAND = bytearray(b'\x57\x0F\x46\x04\x02')
-STOP_STATE_COMMAND = bytearray(b'\x57\x0F\x45\x01\x00\xFF')
 PERIODS_TO_WAIT_IN_STANDBY = 20
-TIME_TO_WAIT_WHILE_MOVING = 1
+MIN_POLL_INTERVAL_MS = 1000
+MAX_POLL_INTERVAL_WHILE_MOVING_MS = 4000
+POLLS_PER_MOVE_BOUNDS = (1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+DEFAULT_CURTAIN_SPEED = 8
+CURTAIN_SPEED_SMOOTHING = 0.3
+# Learned speeds are written to flash after drifting this far, at most once per interval.
+CALIBRATION_SAVE_THRESHOLD = 0.1
+CALIBRATION_SAVE_INTERVAL_MS = 3600000
+PREDICTION_ERROR_BOUNDS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+INTERPOLATION_INTERVAL_MS = 500
+CONNECT_TIMEOUT_MS = 30000
+BACKOFF_INITIAL_MS = 1000
+BACKOFF_MAX_MS = 60000
+RECONNECT_BOUNDS_MS = (250, 500, 1000, 2000, 5000, 10000, 30000, 60000, 120000)
+DISCONNECTED_COMMAND_POLICY = "queue"
+ON_DEMAND_CONNECTION = False
+KEEP_WARM_MS = 10000
+ON_DEMAND_STANDBY_POLL_INTERVAL_MS = 300000
+# (min, max) connection interval in microseconds, picked when connecting.
+CONNECTION_PROFILES = {
+    "fast": (7500, 15000),
+    "power_saving": (100000, 200000),
+}
+MOVING_CONNECTION_PROFILE = "fast"
+IDLE_CONNECTION_PROFILE = "power_saving"
+# Not in CONNECTION_PROFILES, always connected covers use the stack defaults.
+CONNECTED_CONNECTION_PROFILE = "default"
+PASSIVE_ADVERTISEMENTS = False
+ADVERTISEMENT_SCAN_DURATION_MS = 60000
+ADVERTISEMENT_SCAN_INTERVAL_US = 160000
+ADVERTISEMENT_SCAN_WINDOW_US = 40000
+ADVERTISEMENT_SCAN_PAUSE_MS = 1000
+ADVERTISEMENT_FRESH_MS = 60000
+# Unchanged advertisements still get through this often to keep them fresh.
+ADVERTISEMENT_REFRESH_MS = 20000
+ADVERTISED_ADVANCED_PAGE_INTERVAL_MS = 600000
+PACKET_LOG_SIZE = 32
+DUPLICATE_COMMAND_WINDOW_MS = 500
+ACKNOWLEDGED_COMMANDS = ("move", "stop")
+MAX_AWAITED_RESPONSES = 4
+PACKET_LOG_FRAME_SIZE = 20
+NOTIFICATION_CAPTURE_FRAMES = 8
+NOTIFICATION_FRAME_SIZE = 20
+NOTIFICATION_BATCH_BOUNDS = (1, 2, 3, 4, 6, 8)
+MAX_BLE_CONNECTIONS = 3
+MQTT_CONNECT_TIMEOUT_MS = 10000
+PUBLISH_REFRESH_INTERVAL_MS = 600000
+OUTBOUND_QUEUE_MESSAGES = 48
+OUTBOUND_QUEUE_BYTES = 16384
+OUTBOUND_BURST = 8
+MQTT_IN_FLIGHT_WINDOW = 4
+ACKNOWLEDGED_QOS = 1
+DISCOVERY_RETAINED_WAIT_MS = 2000
+GROUP_SKEW_BOUNDS_US = (1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000, 500000)
+POLL_INTERVAL_BOUNDS_MS = (1000, 2000, 5000, 10000, 20000, 30000, 60000, 120000, 300000, 600000)
 ADDR_PUBLIC = 0
 ADDR_RANDOM = 1
 DATA_SERVICE = bluetooth.UUID("cba20d00-224d-11e6-9fb8-0002a5d5c51b")
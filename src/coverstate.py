@@ -0,0 +1,25 @@
+from collections import namedtuple
+
+POSITION = 1 << 0
+MOTION_STATUS = 1 << 1
+STATE = 1 << 2
+BATTERY = 1 << 3
+ADV_STATE = 1 << 4
+ALL = POSITION | MOTION_STATUS | STATE | BATTERY | ADV_STATE
+
+CoverSnapshot = namedtuple(
+    "CoverSnapshot", ("position", "motion_status", "state", "battery", "adv_state"))
+
+EMPTY = CoverSnapshot(None, None, None, None, None)
+
+
+def changed_fields(previous, current):
+    # Attribute dicts are only rebuilt when their frame changed, so identity
+    # is enough to tell them apart; scalars fall back to equality.
+    changed = 0
+    for i in range(len(current)):
+        old = previous[i]
+        new = current[i]
+        if old is not new and old != new:
+            changed |= 1 << i
+    return changed
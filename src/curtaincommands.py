@@ -0,0 +1,65 @@
+_HEADER = 0x57
+_CURTAIN = 0x0F
+_CONTROL = 0x45
+_ADVANCED_PAGE = 0x46
+_ACTION_STOP = 0x00
+_ACTION_MOVE = 0x05
+
+FETCH_STATE_KIND = "fetch_state"
+FETCH_ADVANCED_PAGE_KIND = "fetch_advanced_page"
+MOVE_KIND = "move"
+STOP_KIND = "stop"
+
+ALL_MOTORS = 0x01
+DEFAULT_SPEED = 0xFF
+MIN_POSITION = 0
+MAX_POSITION = 100
+
+
+def _frame(*values):
+    return memoryview(bytes(values))
+
+
+def _control(action, motor, speed, *position):
+    return _frame(_HEADER, _CURTAIN, _CONTROL, motor, action, speed, *position)
+
+
+FETCH_STATE = _frame(_HEADER, 0x02)
+FETCH_ADVANCED_PAGE = _frame(_HEADER, _CURTAIN, _ADVANCED_PAGE, 0x04, 0x02)
+STOP = _control(_ACTION_STOP, ALL_MOTORS, DEFAULT_SPEED)
+
+_POSITIONS = tuple(
+    _control(_ACTION_MOVE, ALL_MOTORS, DEFAULT_SPEED, position)
+    for position in range(MIN_POSITION, MAX_POSITION + 1))
+
+# Frames for non default speeds or motors, built on first use.
+_variants = {}
+
+
+def parse_position(text):
+    # Positions from MQTT are clamped, None if text isn't a whole number.
+    try:
+        position = int(text)
+    except ValueError:
+        return None
+    return min(max(position, MIN_POSITION), MAX_POSITION)
+
+
+def move_to(position, speed=DEFAULT_SPEED, motor=ALL_MOTORS):
+    if not MIN_POSITION <= position <= MAX_POSITION:
+        raise ValueError("Position out of range: %s" % position)
+    if speed == DEFAULT_SPEED and motor == ALL_MOTORS:
+        return _POSITIONS[position]
+    key = (position, speed, motor)
+    if key not in _variants:
+        _variants[key] = _control(_ACTION_MOVE, motor, speed, position)
+    return _variants[key]
+
+
+def stop(motor=ALL_MOTORS):
+    if motor == ALL_MOTORS:
+        return STOP
+    key = (None, None, motor)
+    if key not in _variants:
+        _variants[key] = _control(_ACTION_STOP, motor, DEFAULT_SPEED)
+    return _variants[key]
@@ -0,0 +1,203 @@
+import constants
+
+STATUS_FRAME_LENGTH = 8
+ADVANCED_FRAME_LENGTH = 7
+RESPONSE_OK = b"\x01"
+ADVERTISEMENT_SERVICE_UUIDS = (0xFD3D, 0x0D00)
+WOAN_MANUFACTURER_ID = 0x0969
+CURTAIN_DEVICE_TYPES = b"c{"
+
+
+def _state_2_bits(byte):
+    # state_2 is read like a binary string that is at least 4 digits wide:
+    # the leading digit is the solar panel flag, the next one the calibration
+    # flag and the two after that the motion index.
+    width = 4
+    while byte >> width:
+        width += 1
+    solar = (byte >> (width - 1)) & 1
+    calibrated = (byte >> (width - 2)) & 1
+    motion = (byte >> (width - 4)) & 3
+    return solar << 3 | calibrated << 2 | motion
+
+
+# Packed state_2 flags for every possible byte, so decoding is a single lookup.
+_STATE_2_TABLE = bytes(_state_2_bits(byte) for byte in range(256))
+
+
+def _byte_at(frame, index):
+    # Frames shorter than 8 bytes are treated as zero padded.
+    return frame[index] if index < len(frame) else 0
+
+
+class StatusFrame:
+    __slots__ = (
+        "response_status",
+        "battery_percentage",
+        "firmware_version",
+        "device_chain_length",
+        "state_1",
+        "state_2",
+        "position",
+        "number_of_timers",
+    )
+
+    def __init__(self):
+        self.response_status = 0
+        self.battery_percentage = 0
+        self.firmware_version = 0
+        self.device_chain_length = 0
+        self.state_1 = 0
+        self.state_2 = 0
+        self.position = 0
+        self.number_of_timers = 0
+
+    def decode(self, frame):
+        self.response_status = _byte_at(frame, 0)
+        self.battery_percentage = _byte_at(frame, 1)
+        self.firmware_version = _byte_at(frame, 2)
+        self.device_chain_length = _byte_at(frame, 3)
+        self.state_1 = _byte_at(frame, 4)
+        self.state_2 = _STATE_2_TABLE[_byte_at(frame, 5)]
+        self.position = _byte_at(frame, 6)
+        self.number_of_timers = _byte_at(frame, 7)
+        return self
+
+    @property
+    def is_solar_panel_connected(self):
+        return bool(self.state_2 & 0x08)
+
+    @property
+    def is_calibrated(self):
+        return bool(self.state_2 & 0x04)
+
+    @property
+    def motion_status(self):
+        return constants.MOTIONS[self.state_2 & 0x03]
+
+    def to_dict(self):
+        return {
+            "response_status": self.response_status,
+            "battery_percentage": self.battery_percentage,
+            "firmware_version": self.firmware_version,
+            "device_chain_length": self.device_chain_length,
+            "state_1": self.state_1,
+            "state_2.is_solar_panel_connected": self.is_solar_panel_connected,
+            "state_2.is_calibrated": self.is_calibrated,
+            "state_2.motion_status": self.motion_status,
+            "position": self.position,
+            "number_of_timers": self.number_of_timers,
+        }
+
+
+class AdvancedFrame:
+    __slots__ = (
+        "response_status",
+        "battery_percentage",
+        "firmware_version",
+        "charge_state",
+    )
+
+    def __init__(self):
+        self.response_status = 0
+        self.battery_percentage = 0
+        self.firmware_version = 0
+        self.charge_state = 0
+
+    def decode(self, frame):
+        self.response_status = _byte_at(frame, 0)
+        self.battery_percentage = _byte_at(frame, 1)
+        self.firmware_version = _byte_at(frame, 2)
+        self.charge_state = _byte_at(frame, 3)
+        return self
+
+    @property
+    def state_of_charge(self):
+        return constants.STATES_OF_CHARGE[self.charge_state]
+
+    @property
+    def is_adapter_plugged_in(self):
+        return "adapter" in self.state_of_charge
+
+    def to_dict(self):
+        return {
+            "response_status": self.response_status,
+            "battery_percentage": self.battery_percentage,
+            "firmware_version": self.firmware_version,
+            "state_of_charge": self.state_of_charge,
+        }
+
+
+class AdvertisementFrame:
+    __slots__ = (
+        "battery_percentage",
+        "is_calibrated",
+        "is_in_motion",
+        "position",
+        "light_level",
+        "device_chain_length",
+    )
+
+    def __init__(self):
+        self.battery_percentage = 0
+        self.is_calibrated = False
+        self.is_in_motion = False
+        self.position = 0
+        self.light_level = 0
+        self.device_chain_length = 0
+
+    def decode(self, service_data, manufacturer_data=None):
+        # Service data is the device type, a flags byte, the battery and then
+        # position and light level. Newer firmware moves the last two into
+        # the manufacturer data, after the MAC and a sequence number.
+        if len(service_data) < 3 or service_data[0] not in CURTAIN_DEVICE_TYPES:
+            return None
+        if manufacturer_data is not None and len(manufacturer_data) >= 10:
+            device_data = manufacturer_data[8:10]
+        elif len(service_data) >= 5:
+            device_data = service_data[3:5]
+        else:
+            return None
+        self.is_calibrated = bool(service_data[1] & 0x40)
+        self.battery_percentage = service_data[2] & 0x7F
+        self.is_in_motion = bool(device_data[0] & 0x80)
+        self.position = min(device_data[0] & 0x7F, 100)
+        self.light_level = device_data[1] >> 4
+        self.device_chain_length = device_data[1] & 0x07
+        return self
+
+    def patch_status_frame(self, frame, motion):
+        # Overwrite the advertised fields of a status frame and keep the ones
+        # only a GATT fetch knows about.
+        frame[0] = RESPONSE_OK[0]
+        frame[1] = self.battery_percentage
+        frame[3] = self.device_chain_length
+        frame[5] = _STATE_2_TABLE[frame[5]] & 0x08 | self.is_calibrated << 2 | motion
+        frame[6] = self.position
+
+    def patch_advanced_frame(self, frame):
+        frame[1] = self.battery_percentage
+
+
+class FrameRegistry:
+    def __init__(self):
+        self._handlers = {}
+
+    def register(self, length, handler, header=RESPONSE_OK):
+        self._handlers.setdefault(length, []).append((header, handler))
+
+    def dispatch(self, frame):
+        handlers = self._handlers.get(len(frame))
+        if handlers:
+            for header, handler in handlers:
+                if FrameRegistry._starts_with(frame, header):
+                    handler(frame)
+                    return True
+        return False
+
+    @staticmethod
+    def _starts_with(frame, header):
+        for i in range(len(header)):
+            if frame[i] != header[i]:
+                return False
+        return True
@@ -0,0 +1,130 @@
+import json
+import uasyncio as asyncio
+import ulogging
+import utime
+
+import commandscheduler
+import constants
+import curtaincommands
+import coverstate
+import metrics
+
+log = ulogging.getLogger(__name__)
+log.setLevel(ulogging.DEBUG)
+
+
+def group_id_from_name(name):
+    return "group_" + name.lower().replace(" ", "_")
+
+
+class CurtainGroup:
+    def __init__(self, topics, curtains, publish):
+        self.topics = topics
+        self.curtains = curtains
+        self._publish = publish
+        self._position = None
+        self._motion_status = None
+        self.issue_skew = metrics.Histogram(constants.GROUP_SKEW_BOUNDS_US)
+        self.ack_skew = metrics.Histogram(constants.GROUP_SKEW_BOUNDS_US)
+        self.moves = 0
+        self.unconnected = 0
+        for curtain in curtains:
+            curtain.add_state_listener(self.on_member_state_changed)
+
+    @property
+    def covers(self):
+        return [curtain.cover for curtain in self.curtains]
+
+    def discovery_documents(self):
+        data = self.topics.discovery_data()
+        # The group is only available while every member is.
+        data["availability"] = [{"topic": constants.ESP_AVAILIBILITY_TOPIC}] + [
+            {"topic": curtain.topics.availability} for curtain in self.curtains]
+        return ((self.topics.discovery, data),)
+
+    async def handle_message(self, topic: str, msg: str):
+        if topic == self.topics.set_command:
+            if msg == "STOP":
+                await self._fan_out((commandscheduler.STOP, None))
+            elif msg == "OPEN":
+                await self._fan_out((commandscheduler.OPEN, None))
+            elif msg == "CLOSE":
+                await self._fan_out((commandscheduler.CLOSE, None))
+        elif topic == self.topics.set_position:
+            position = curtaincommands.parse_position(msg)
+            if position is None:
+                log.warning("Ignored invalid position %s", msg)
+            else:
+                await self._fan_out((commandscheduler.MOVE, position))
+        elif topic == self.topics.diagnostics_command and msg == "DUMP_STATS":
+            self._publish(self.topics.stats_diagnostics, json.dumps(self.stats()))
+
+    async def _fan_out(self, command):
+        covers = self.covers
+        # Connect everyone first so the writes themselves go out back to back.
+        await asyncio.gather(*[
+            cover.connect(constants.MOVING_CONNECTION_PROFILE) for cover in covers if not cover.is_subscribed])
+        if not all(cover.is_subscribed for cover in covers):
+            self.unconnected += 1
+            log.warning("Not every member of %s is connected", self.topics.device_id)
+        # Through the members' schedulers, so an older single curtain command
+        # can't run after the group's.
+        written = await asyncio.gather(*[curtain.scheduler.run(command) for curtain in self.curtains])
+        self._report_move(written)
+
+    def _report_move(self, written):
+        if None in written:
+            # Some member held the command instead of writing it.
+            return
+        issued = [ticks[0] for ticks in written]
+        done = [ticks[1] for ticks in written]
+        issue_skew = self._spread(issued)
+        ack_skew = self._spread(done)
+        self.moves += 1
+        self.issue_skew.record(issue_skew)
+        self.ack_skew.record(ack_skew)
+        log.debug("Group %s moved with %s us issue skew, %s us ack skew",
+                  self.topics.device_id, issue_skew, ack_skew)
+        self._publish(self.topics.stats_diagnostics, json.dumps(
+            {"move": {"issue_skew_us": issue_skew, "ack_skew_us": ack_skew}}))
+
+    @staticmethod
+    def _spread(ticks):
+        first = ticks[0]
+        lowest = highest = 0
+        for value in ticks:
+            offset = utime.ticks_diff(value, first)
+            lowest = min(lowest, offset)
+            highest = max(highest, offset)
+        return highest - lowest
+
+    def on_member_state_changed(self, snapshot, changed):
+        if not changed & (coverstate.POSITION | coverstate.MOTION_STATUS):
+            return
+        positions = [curtain.cover.position for curtain in self.curtains]
+        if None in positions:
+            return
+        position = sum(positions) // len(positions)
+        topics = self.topics
+        if position != self._position:
+            if self._publish(topics.position, f"{position}", True, topics.qos(topics.position)):
+                self._position = position
+        motion_status = self._group_motion_status(position)
+        if motion_status != self._motion_status:
+            if self._publish(topics.state, motion_status, True, topics.qos(topics.state)):
+                self._motion_status = motion_status
+
+    def _group_motion_status(self, position):
+        statuses = [curtain.cover.motion_status for curtain in self.curtains]
+        for moving in ("opening", "closing"):
+            if moving in statuses:
+                return moving
+        return "closed" if position < 5 else "open"
+
+    def stats(self):
+        return {
+            "moves": self.moves,
+            "unconnected": self.unconnected,
+            "issue_skew_us": self.issue_skew.to_dict(),
+            "ack_skew_us": self.ack_skew.to_dict(),
+        }
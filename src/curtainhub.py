@@ -0,0 +1,189 @@
+import json
+import ubinascii
+import uasyncio as asyncio
+import ulogging
+import utime
+import wifiutils
+import constants
+import metrics
+from connectionscheduler import ConnectionScheduler
+from curtaingroup import CurtainGroup, group_id_from_name
+from curtaintopics import CurtainTopics, device_id_from_mac
+from discoverycache import DiscoveryCache
+from mqttclient import MQTTClient, MQTTException
+from mqttcurtain import MQTTCurtain
+from outboundqueue import OutboundQueue
+
+log = ulogging.getLogger(__name__)
+log.setLevel(ulogging.DEBUG)
+
+
+def curtains_from_secrets(secrets):
+    if "curtains" in secrets:
+        return [
+            (curtain["mac"], CurtainTopics(
+                device_id_from_mac(curtain["mac"]), curtain.get("name", constants.DEFAULT_CURTAIN_NAME)))
+            for curtain in secrets["curtains"]
+        ]
+    # A single "mac" keeps the topics of the one curtain per ESP32 setup, so
+    # the existing Home Assistant entity stays the same.
+    return [(secrets["mac"], CurtainTopics(constants.CLIENT_ID))]
+
+
+def groups_from_secrets(secrets):
+    return [
+        (CurtainTopics(group_id_from_name(group["name"]), group["name"]), group["curtains"])
+        for group in secrets.get("groups", ())
+    ]
+
+
+class CurtainHub:
+    def __init__(self, client: MQTTClient, curtains, on_demand=constants.ON_DEMAND_CONNECTION,
+                 scanner=None, max_connections=constants.MAX_BLE_CONNECTIONS, groups=()):
+        self.client = client
+        self.scanner = scanner
+        self._connecting = False
+        self._connected = asyncio.Event()
+        self.outbound = OutboundQueue(client, self.connect)
+        if len(curtains) > max_connections and not on_demand:
+            log.info("%s curtains share %s connections, connecting on demand", len(curtains), max_connections)
+            on_demand = True
+        if on_demand:
+            poll_interval_ms = constants.ON_DEMAND_STANDBY_POLL_INTERVAL_MS
+        else:
+            poll_interval_ms = constants.PERIODS_TO_WAIT_IN_STANDBY * 1000
+        self.connections = ConnectionScheduler(max_connections, poll_interval_ms)
+        self.curtains = []
+        self._routes = {}
+        for mac, topics in curtains:
+            curtain = MQTTCurtain(client, mac, on_demand, scanner, topics, self.connections, self.outbound)
+            self.curtains.append(curtain)
+            for topic in topics.subscriptions:
+                self._routes[topic] = curtain
+        by_mac = {curtain.cover.addr: curtain for curtain in self.curtains}
+        self.groups = []
+        for topics, macs in groups:
+            group = CurtainGroup(
+                topics, [by_mac[ubinascii.unhexlify(mac.replace(":", ""))] for mac in macs], self.publish)
+            self.groups.append(group)
+            for topic in topics.subscriptions:
+                self._routes[topic] = group
+        # Serialized once here instead of on every reconnect.
+        self.discovery = DiscoveryCache(client, self.publish)
+        for owner in self.curtains + self.groups:
+            for topic, data in owner.discovery_documents():
+                self.discovery.add(topic, data)
+        self.reconnect_time = metrics.Histogram(constants.RECONNECT_BOUNDS_MS)
+        self.last_reconnect = None
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        loop.create_task(self.connections.run())
+        loop.create_task(self.outbound.run())
+        loop.create_task(self.await_message())
+        loop.create_task(self.ping())
+        for curtain in self.curtains:
+            loop.create_task(curtain.publish_predictions())
+
+    def connect(self, clear=False):
+        # Called from sync callbacks, the handshake runs in its own task.
+        if self._connecting:
+            return
+        self._connecting = True
+        self._connected.clear()
+        asyncio.get_event_loop().create_task(self._connect(clear))
+
+    async def _connect(self, clear):
+        started = utime.ticks_ms()
+        sent_bytes = self.client.sent_bytes
+        try:
+            self.client.set_callback(self.on_message)
+            self.client.set_last_will(
+                constants.ESP_AVAILIBILITY_TOPIC, "offline", True, constants.ACKNOWLEDGED_QOS)
+            await self.client.connect(clear)
+            # Start reading, the discovery check needs the broker's answers.
+            self._connected.set()
+            self.client.subscribe(constants.ESP_AVAILIBILITY_TOPIC)
+            self.client.subscribe(constants.DIAGNOSTICS_COMMAND_TOPIC)
+            for curtain in self.curtains:
+                curtain.subscribe()
+            for group in self.groups:
+                for topic in group.topics.subscriptions:
+                    self.client.subscribe(topic, group.topics.qos(topic))
+            await self.discovery.publish_changed()
+            self.publish_esp_online()
+            # Everything held back while offline goes out in one burst.
+            self.outbound.resume()
+            await self.client.flush()
+            if not self.client.is_connected:
+                raise OSError("MQTT connection lost while getting ready")
+            self._record_reconnect(started, sent_bytes)
+        except (OSError, EOFError, MQTTException, asyncio.TimeoutError):  # type: ignore
+            log.debug("Failed to connect")
+        finally:
+            self._connecting = False
+
+    def _record_reconnect(self, started, sent_bytes):
+        elapsed = utime.ticks_diff(utime.ticks_ms(), started)
+        self.reconnect_time.record(elapsed)
+        self.last_reconnect = {"ms": elapsed, "bytes": self.client.sent_bytes - sent_bytes}
+        log.info("MQTT ready after %s ms, %s bytes sent", elapsed, self.last_reconnect["bytes"])
+
+    def publish_esp_online(self):
+        self.publish(constants.ESP_AVAILIBILITY_TOPIC, "online", True, constants.ACKNOWLEDGED_QOS)
+
+    async def handle_message(self, topic: str, msg: str):
+        if (topic == constants.ESP_AVAILIBILITY_TOPIC and msg != "online"):
+            self.publish_esp_online()
+        elif topic == constants.DIAGNOSTICS_COMMAND_TOPIC:
+            if msg == "DUMP_STATS":
+                self.publish(constants.STATS_DIAGNOSTICS_TOPIC, json.dumps(self.stats()))
+        elif topic in self._routes:
+            await self._routes[topic].handle_message(topic, msg)
+
+    def stats(self):
+        return {
+            "connections": self.connections.stats(),
+            "mqtt": self.client.stats(),
+            "outbound": self.outbound.stats(),
+            "discovery": self.discovery.stats(),
+            "reconnect_ms": self.reconnect_time.to_dict(),
+            "last_reconnect": self.last_reconnect,
+            "groups": {group.topics.device_id: group.stats() for group in self.groups},
+            "scanner": self.scanner.stats() if self.scanner else None,
+        }
+
+    def on_message(self, topic, msg):
+        topic = topic.decode('UTF-8')
+        if self.discovery.on_message(topic, msg):
+            return
+        msg = msg.decode('UTF-8')
+        log.info("Topic: %s sent message: %s", topic, msg)
+        asyncio.get_event_loop().create_task(self.handle_message(topic, msg))
+
+    async def ping(self):
+        while True:
+            if wifiutils.is_network_connected():
+                try:
+                    self.client.ping()
+                except OSError as e:  # type: ignore
+                    log.exc(e, "Error while pinging")
+                    self.connect()
+            await asyncio.sleep(2)
+
+    async def await_message(self):
+        # Sleeps in the stream until the broker sends something.
+        while True:
+            await self._connected.wait()
+            try:
+                await self.client.wait_msg()
+            except (OSError, EOFError) as e:  # type: ignore
+                log.exc(e, "Error while awaiting message")
+                # Wait for the next handshake instead of reading the dead
+                # stream again, a handshake in progress finds out on its own.
+                self._connected.clear()
+                self.connect()
+
+    def publish(self, topic, data, persist=False, qos=0):
+        log.debug("Queueing %s to %s", data, topic)
+        return self.outbound.put(topic, data, persist, qos)
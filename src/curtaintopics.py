@@ -0,0 +1,84 @@
+import constants
+
+
+def device_id_from_mac(mac):
+    return mac.replace(":", "").lower()
+
+
+class CurtainTopics:
+    def __init__(self, device_id, name=constants.DEFAULT_CURTAIN_NAME):
+        self.device_id = device_id
+        self.name = name
+        self.discovery = f"homeassistant/cover/{device_id}/cover/config"
+        self.battery_discovery = f"homeassistant/sensor/{device_id}/sensor/config"
+        self.attributes = f"esp32/{device_id}/cover/attributes"
+        self.battery_attributes = f"esp32/{device_id}/battery/attributes"
+        self.battery_state = f"esp32/{device_id}/battery/state"
+        self.position = f"esp32/{device_id}/cover/position"
+        self.state = f"esp32/{device_id}/cover/state"
+        self.set_position = f"esp32/{device_id}/cover/set_position"
+        self.set_command = f"esp32/{device_id}/cover/set"
+        self.availability = f"esp32/{device_id}/cover_availibility"
+        self.diagnostics_command = f"esp32/{device_id}/diagnostics/set"
+        self.packets_diagnostics = f"esp32/{device_id}/diagnostics/packets"
+        self.stats_diagnostics = f"esp32/{device_id}/diagnostics/stats"
+        # State a reconnect must not lose, and the commands we must not miss.
+        self._acknowledged = (
+            self.state, self.position, self.availability, self.set_command, self.set_position)
+
+    @property
+    def subscriptions(self):
+        return (self.set_command, self.set_position, self.diagnostics_command)
+
+    def qos(self, topic):
+        if topic in self._acknowledged:
+            return constants.ACKNOWLEDGED_QOS
+        return 0
+
+    def _device(self):
+        return {
+            "identifiers": [f"esp32_{self.device_id}"],
+            "manufacturer": "blackstardlb",
+            "model": "esp32 switch bot cover hub",
+            "name": self.name,
+        }
+
+    def _availability(self):
+        return [
+            {
+                "topic": constants.ESP_AVAILIBILITY_TOPIC
+            },
+            {
+                "topic": self.availability
+            }
+        ]
+
+    def discovery_data(self):
+        return {
+            "availability": self._availability(),
+            "availability_mode": "all",
+            "device_class": "curtain",
+            "command_topic": self.set_command,
+            "state_topic": self.state,
+            "position_topic": self.position,
+            "set_position_topic": self.set_position,
+            "device": self._device(),
+            "json_attributes_topic": self.attributes,
+            "name": self.name,
+            "optimistic": "false",
+            "unique_id": f"{self.device_id}_light_esp32"
+        }
+
+    def battery_discovery_data(self):
+        return {
+            "availability": self._availability(),
+            "availability_mode": "all",
+            "device_class": "battery",
+            "device": self._device(),
+            "json_attributes_topic": self.battery_attributes,
+            "state_topic": self.battery_state,
+            "name": f"{self.name} Battery",
+            "optimistic": "false",
+            "unique_id": f"{self.device_id}_battery_esp32",
+            "unit_of_measurement": "%"
+        }
@@ -0,0 +1,76 @@
+import json
+import ubinascii
+
+import constants
+
+
+class _Document:
+    def __init__(self, data):
+        self.payload = json.dumps(data).encode()
+        self.digest = ubinascii.crc32(self.payload)
+        self.retained = False
+
+
+class DiscoveryCache:
+    # Home Assistant discovery documents serialized once at boot, with a
+    # checksum so the copy the broker retains can be checked on reconnect
+    # instead of sending every document again.
+    def __init__(self, client, publish, wait_ms=constants.DISCOVERY_RETAINED_WAIT_MS):
+        self._client = client
+        self._publish = publish
+        self._wait_ms = wait_ms
+        self._documents = {}
+        self._checking = False
+        self.published = 0
+        self.published_bytes = 0
+        self.skipped = 0
+        self.skipped_bytes = 0
+
+    def add(self, topic, data):
+        self._documents[topic] = _Document(data)
+
+    @property
+    def size(self):
+        return sum(len(document.payload) for document in self._documents.values())
+
+    def on_message(self, topic, msg):
+        # Returns whether the message was a retained document being checked.
+        if not self._checking:
+            return False
+        document = self._documents.get(topic)
+        if document is None:
+            return False
+        document.retained = len(msg) == len(document.payload) and ubinascii.crc32(msg) == document.digest
+        return True
+
+    async def publish_changed(self):
+        for document in self._documents.values():
+            document.retained = False
+        self._checking = True
+        try:
+            for topic in self._documents:
+                self._client.subscribe(topic)
+            # The broker sends retained messages while it handles the
+            # SUBSCRIBE, so they are all in before the answer to this ping.
+            await self._client.round_trip(self._wait_ms)
+            for topic in self._documents:
+                self._client.unsubscribe(topic)
+        finally:
+            self._checking = False
+        for topic, document in self._documents.items():
+            if document.retained:
+                self.skipped += 1
+                self.skipped_bytes += len(document.payload)
+            elif self._publish(topic, document.payload, True):
+                self.published += 1
+                self.published_bytes += len(document.payload)
+
+    def stats(self):
+        return {
+            "documents": len(self._documents),
+            "bytes": self.size,
+            "published": self.published,
+            "published_bytes": self.published_bytes,
+            "skipped": self.skipped,
+            "skipped_bytes": self.skipped_bytes,
+        }
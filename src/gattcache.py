@@ -0,0 +1,54 @@
+from aioble.client import ClientCharacteristic, ClientService
+
+import constants
+import slutils
+
+
+class GattCache:
+    def __init__(self, mac):
+        self._mac = mac
+        self._entry = slutils.read_gatt_cache().get(mac)
+
+    @property
+    def is_cached(self):
+        return self._entry is not None
+
+    @property
+    def cccd_handle(self):
+        return self._entry["cccd"]
+
+    def characteristics(self, connection):
+        # Rebuilds the discovered objects straight from the cached handles.
+        start_handle, end_handle = self._entry["service"]
+        service = ClientService(connection, start_handle, end_handle, constants.DATA_SERVICE)
+        write_characteristic = ClientCharacteristic(
+            service, *self._entry["write"], constants.WRITE_CHAR)
+        notification_characteristic = ClientCharacteristic(
+            service, *self._entry["notification"], constants.NOTIFICATION_CHAR)
+        return write_characteristic, notification_characteristic
+
+    def store(self, service, write_characteristic, notification_characteristic):
+        self._entry = {
+            "service": [service._start_handle, service._end_handle],
+            "write": GattCache._handles(write_characteristic),
+            "notification": GattCache._handles(notification_characteristic),
+            "cccd": notification_characteristic.cccd_handle,
+        }
+        self._save()
+
+    def invalidate(self):
+        if self._entry is not None:
+            self._entry = None
+            self._save()
+
+    def _save(self):
+        cache = slutils.read_gatt_cache()
+        if self._entry is None:
+            cache.pop(self._mac, None)
+        else:
+            cache[self._mac] = self._entry
+        slutils.write_gatt_cache(cache)
+
+    @staticmethod
+    def _handles(characteristic):
+        return [characteristic._end_handle, characteristic._value_handle, characteristic.properties]
@@ -5,6 +5,7 @@ from micropython import const
 
 import bluetooth
 import struct
+import time
 
 import uasyncio as asyncio
 
@@ -39,9 +40,14 @@ _ADV_TYPE_UUID32_INCOMPLETE = const(0x4)
 _ADV_TYPE_UUID32_COMPLETE = const(0x5)
 _ADV_TYPE_UUID128_INCOMPLETE = const(0x6)
 _ADV_TYPE_UUID128_COMPLETE = const(0x7)
+_ADV_TYPE_SERVICE_DATA_UUID16 = const(0x16)
 _ADV_TYPE_APPEARANCE = const(0x19)
 _ADV_TYPE_MANUFACTURER = const(0xFF)
 
+_DEDUPLICATE_SIZE = const(16)
+
+_DEFAULT_CONNECT_SCAN_DURATION_MS = const(2000)
+
 
 # Keep track of the active scanner so IRQs can be delivered to it.
 _active_scanner = None
@@ -57,6 +63,9 @@ def _central_irq(event, data):
         addr_type, addr, adv_type, rssi, adv_data = data
         if not _active_scanner:
             return
+        # Filter on the IRQ buffers before copying anything.
+        if not _active_scanner._accept(addr, adv_type, adv_data):
+            return
         _active_scanner._queue.append((addr_type, bytes(addr), adv_type, rssi, bytes(adv_data)))
         _active_scanner._event.set()
     elif event == _IRQ_SCAN_DONE:
@@ -103,7 +112,13 @@ async def _cancel_pending():
 
 # Start connecting to a peripheral.
 # Call device.connect() rather than using method directly.
-async def _connect(connection, timeout_ms):
+async def _connect(
+    connection,
+    timeout_ms,
+    scan_duration_ms=None,
+    min_conn_interval_us=None,
+    max_conn_interval_us=None,
+):
     device = connection.device
     if device in _connecting:
         return
@@ -121,7 +136,16 @@ async def _connect(connection, timeout_ms):
 
     try:
         with DeviceTimeout(None, timeout_ms):
-            ble.gap_connect(device.addr_type, device.addr)
+            if scan_duration_ms is None and min_conn_interval_us is None:
+                ble.gap_connect(device.addr_type, device.addr)
+            else:
+                ble.gap_connect(
+                    device.addr_type,
+                    device.addr,
+                    scan_duration_ms or _DEFAULT_CONNECT_SCAN_DURATION_MS,
+                    min_conn_interval_us,
+                    max_conn_interval_us,
+                )
 
             # Wait for the connected IRQ.
             await connection._event.wait()
@@ -210,17 +234,127 @@ class ScanResult:
             if filter is None or m == filter:
                 yield (m, u[2:])
 
+    # Generator that returns (service_uuid16, data) tuples.
+    def service_data(self, filter=None):
+        for u in self._decode_field(_ADV_TYPE_SERVICE_DATA_UUID16):
+            if len(u) < 2:
+                continue
+            s = struct.unpack("<H", u[0:2])[0]
+            if filter is None or s == filter:
+                yield (s, u[2:])
+
 
 # Use with:
 # async with aioble.scan(...) as scanner:
 #   async for result in scanner:
 #     ...
+# Compare an IRQ memoryview with bytes without allocating.
+def _equals(buf, value):
+    if len(buf) != len(value):
+        return False
+    for i in range(len(value)):
+        if buf[i] != value[i]:
+            return False
+    return True
+
+
+# Returns true if any 16-bit UUID in the UUID lists or service data of the
+# payload is in services.
+def _has_service(adv_data, services):
+    i = 0
+    while i + 1 < len(adv_data):
+        length = adv_data[i]
+        if adv_data[i + 1] in (
+            _ADV_TYPE_UUID16_INCOMPLETE,
+            _ADV_TYPE_UUID16_COMPLETE,
+            _ADV_TYPE_SERVICE_DATA_UUID16,
+        ):
+            j = i + 2
+            end = min(i + length + 1, len(adv_data))
+            while j + 1 < end:
+                if adv_data[j] | adv_data[j + 1] << 8 in services:
+                    return True
+                if adv_data[i + 1] == _ADV_TYPE_SERVICE_DATA_UUID16:
+                    break
+                j += 2
+        i += 1 + length
+    return False
+
+
+# Small integer checksum that stays a small int on 32-bit ports.
+def _checksum(buf, value=0):
+    for b in buf:
+        value = (value * 31 + b) & 0xFFFFFF
+    return value
+
+
+# Remembers the last payload checksum for recently seen address and
+# advertising type pairs, and evicts the least recently used one. With
+# refresh_ms set, an unchanged payload is let through again once that long
+# has passed since it last was, so listeners can tell the device is alive.
+class _Deduplicator:
+    def __init__(self, size, refresh_ms=None):
+        self._keys = [None] * size
+        self._values = [0] * size
+        self._used = [0] * size
+        self._passed = [0] * size
+        self._clock = 0
+        self._refresh_ms = refresh_ms
+
+    def is_duplicate(self, addr, adv_type, adv_data):
+        key = _checksum(addr, adv_type)
+        value = _checksum(adv_data)
+        now = time.ticks_ms()
+        self._clock += 1
+        oldest = 0
+        for i in range(len(self._keys)):
+            if self._keys[i] == key:
+                self._used[i] = self._clock
+                if self._values[i] == value and (
+                    self._refresh_ms is None
+                    or time.ticks_diff(now, self._passed[i]) < self._refresh_ms
+                ):
+                    return True
+                self._values[i] = value
+                self._passed[i] = now
+                return False
+            if self._used[i] < self._used[oldest]:
+                oldest = i
+        self._keys[oldest] = key
+        self._values[oldest] = value
+        self._used[oldest] = self._clock
+        self._passed[oldest] = now
+        return False
+
+
 class scan:
-    def __init__(self, duration_ms, interval_us=None, window_us=None, active=False):
+    # addresses is an optional list of 6 byte addresses and services an
+    # optional collection of 16-bit service UUIDs (as ints) that a payload
+    # must mention. With deduplicate set, payloads that are unchanged since
+    # the device last sent them are dropped, including RSSI-only updates,
+    # except once every refresh_ms when that is given.
+    def __init__(
+        self,
+        duration_ms,
+        interval_us=None,
+        window_us=None,
+        active=False,
+        addresses=None,
+        services=None,
+        deduplicate=False,
+        refresh_ms=None,
+    ):
         self._queue = []
         self._event = asyncio.ThreadSafeFlag()
         self._done = False
 
+        self._addresses = addresses
+        self._services = services
+        self._deduplicator = _Deduplicator(_DEDUPLICATE_SIZE, refresh_ms) if deduplicate else None
+        self.filtered = 0
+        self.duplicates = 0
+        self.accepted = 0
+
         # Keep track of what we've already seen.
         self._results = set()
 
@@ -240,6 +374,24 @@ class scan:
         ble.gap_scan(self._duration_ms, self._interval_us, self._window_us, self._active)
         return self
 
+    # Called from the scan result IRQ, must not allocate.
+    def _accept(self, addr, adv_type, adv_data):
+        if self._addresses is not None:
+            for a in self._addresses:
+                if _equals(addr, a):
+                    break
+            else:
+                self.filtered += 1
+                return False
+        if self._services is not None and not _has_service(adv_data, self._services):
+            self.filtered += 1
+            return False
+        if self._deduplicator and self._deduplicator.is_duplicate(addr, adv_type, adv_data):
+            self.duplicates += 1
+            return False
+        self.accepted += 1
+        return True
+
     async def __aexit__(self, exc_type, exc_val, exc_traceback):
         # Cancel the current scan if we're still the active scanner. This will
         # happen if the loop breaks early before the scan duration completes.
@@ -272,8 +424,9 @@ class scan:
                     result = ScanResult(device)
                     self._results.add(result)
 
-                # Add the new information from this event.
-                if result._update(adv_type, rssi, adv_data):
+                # Add the new information from this event. The deduplicator
+                # already let through only new or refreshed payloads.
+                if result._update(adv_type, rssi, adv_data) or self._deduplicator:
                     # It's new information, so re-yield this result.
                     return result
 
@@ -72,7 +72,8 @@ def _client_irq(event, data):
         ClientCharacteristic._write_done(conn_handle, value_handle, status)
     elif event == _IRQ_GATTC_NOTIFY:
         conn_handle, value_handle, notify_data = data
-        ClientCharacteristic._on_notify(conn_handle, value_handle, bytes(notify_data))
+        # Copied in _on_notify, captured notifications go straight into the ring.
+        ClientCharacteristic._on_notify(conn_handle, value_handle, notify_data)
     elif event == _IRQ_GATTC_INDICATE:
         conn_handle, value_handle, indicate_data = data
         ClientCharacteristic._on_indicate(conn_handle, value_handle, bytes(indicate_data))
@@ -81,6 +82,59 @@ def _client_irq(event, data):
 register_irq_handler(_client_irq, None)
 
 
+# Fixed size ring of preallocated frame buffers for captured notifications.
+# Has the parts of the deque interface used by ClientCharacteristic, but
+# copies incoming data instead of keeping a reference to it.
+class NotificationRing:
+    def __init__(self, count, frame_size):
+        self._frames = [bytearray(frame_size) for _ in range(count)]
+        self._lengths = [0] * count
+        self._head = 0
+        self._len = 0
+        # Frames longer than frame_size, stored truncated.
+        self.overflows = 0
+        # Frames lost because every buffer was still unread.
+        self.dropped = 0
+        self.captured = 0
+
+    def __len__(self):
+        return self._len
+
+    def clear(self):
+        self._head = 0
+        self._len = 0
+
+    # Called from the IRQ. Unread frames are never overwritten, so a frame
+    # handed out by peek() stays valid until discard().
+    def append(self, data):
+        if self._len == len(self._frames):
+            self.dropped += 1
+            return
+        i = (self._head + self._len) % len(self._frames)
+        frame = self._frames[i]
+        n = len(data)
+        if n > len(frame):
+            self.overflows += 1
+            n = len(frame)
+        for j in range(n):
+            frame[j] = data[j]
+        self._lengths[i] = n
+        self._len += 1
+        self.captured += 1
+
+    def peek(self):
+        return memoryview(self._frames[self._head])[: self._lengths[self._head]]
+
+    def discard(self):
+        self._head = (self._head + 1) % len(self._frames)
+        self._len -= 1
+
+    def popleft(self):
+        data = bytes(self.peek())
+        self.discard()
+        return data
+
+
 # Async generator for discovering services, characteristics, descriptors.
 class ClientDiscover:
     def __init__(self, connection, disc_type, parent, timeout_ms, *args):
@@ -385,6 +439,31 @@ class ClientCharacteristic(BaseClientCharacteristic):
         self._check(_FLAG_NOTIFY)
         return await self._notified_indicated(self._notify_queue, self._notify_event, timeout_ms)
 
+    # Keep notifications in the given NotificationRing instead of only the
+    # most recent one. The ring can be reused across connections.
+    def capture(self, ring):
+        self._check(_FLAG_NOTIFY)
+        ring.clear()
+        self._notify_queue = ring
+
+    # Wait for at least one captured notification, then call handler with
+    # each pending one in arrival order and return how many were handled.
+    # The memoryview passed to handler is only valid during the call.
+    async def notified_batch(self, handler, timeout_ms=None):
+        self._check(_FLAG_NOTIFY)
+        self._register_with_connection()
+        ring = self._notify_queue
+        # The flag can still be set from frames handled by an earlier batch.
+        while not len(ring):
+            with self._connection().timeout(timeout_ms):
+                await self._notify_event.wait()
+        handled = 0
+        while len(ring):
+            handler(ring.peek())
+            ring.discard()
+            handled += 1
+        return handled
+
     def _on_notify_indicate(self, queue, event, data):
         # If we've gone from empty to one item, then wake something
         # blocking on `await char.notified()` (or `await char.indicated()`).
@@ -403,9 +482,10 @@ class ClientCharacteristic(BaseClientCharacteristic):
     # Map an incoming notify IRQ to a registered characteristic.
     def _on_notify(conn_handle, value_handle, notify_data):
         if characteristic := ClientCharacteristic._find(conn_handle, value_handle):
-            characteristic._on_notify_indicate(
-                characteristic._notify_queue, characteristic._notify_event, notify_data
-            )
+            queue = characteristic._notify_queue
+            if not isinstance(queue, NotificationRing):
+                notify_data = bytes(notify_data)
+            characteristic._on_notify_indicate(queue, characteristic._notify_event, notify_data)
 
     # Wait for the next indication.
     # Will return immediately if an indication has already been received.
@@ -424,12 +504,23 @@ class ClientCharacteristic(BaseClientCharacteristic):
 
     # Write to the Client Characteristic Configuration to subscribe to
     # notify/indications for this characteristic.
-    async def subscribe(self, notify=True, indicate=False):
+    # If the CCCD handle is already known (e.g. cached from an earlier
+    # connection) descriptor discovery is skipped and the write is sent with
+    # response, so that a stale handle raises GattError.
+    async def subscribe(self, notify=True, indicate=False, cccd_handle=None):
         # Ensure that the generated notifications are dispatched in case the app
         # hasn't awaited on notified/indicated yet.
         self._register_with_connection()
-        if cccd := await self.descriptor(bluetooth.UUID(_CCCD_UUID)):
-            await cccd.write(struct.pack("<H", _CCCD_NOTIFY * notify + _CCCD_INDICATE * indicate))
+        if cccd_handle is not None:
+            cccd = ClientDescriptor(self, cccd_handle, bluetooth.UUID(_CCCD_UUID))
+        else:
+            cccd = await self.descriptor(bluetooth.UUID(_CCCD_UUID))
+        if cccd:
+            self.cccd_handle = cccd._value_handle
+            await cccd.write(
+                struct.pack("<H", _CCCD_NOTIFY * notify + _CCCD_INDICATE * indicate),
+                response=cccd_handle is not None,
+            )
         else:
             raise ValueError("CCCD not found")
 
@@ -1,10 +1,11 @@
 import ulogging
 import uasyncio as asyncio
-import umqtt.simple as mqtt
 import slutils
 import wifiutils
 import constants
-from mqttcurtain import MQTTCurtain
+from advertisementscanner import AdvertisementScanner
+from mqttclient import MQTTClient
+from curtainhub import CurtainHub, curtains_from_secrets, groups_from_secrets
 
 log = ulogging.getLogger(__name__)
 log.setLevel(ulogging.DEBUG)
@@ -13,17 +14,22 @@ loop = asyncio.get_event_loop()
 
 async def main():
     secrets = slutils.read_secrets()
-    mqtt_client = mqtt.MQTTClient(constants.CLIENT_ID,
-                                  secrets["mqtt"]["host"],
-                                  secrets["mqtt"]["port"],
-                                  secrets["mqtt"]["user"],
-                                  secrets["mqtt"]["password"],
-                                  5)
-    mqtt_cover = MQTTCurtain(mqtt_client, secrets["mac"])
-    wifiutils.register_on_connect_callback(mqtt_cover.connect)
-    mqtt_cover.connect(True)
-    loop.create_task(mqtt_cover.await_message())
-    loop.create_task(mqtt_cover.ping())
+    mqtt_client = MQTTClient(constants.CLIENT_ID,
+                             secrets["mqtt"]["host"],
+                             secrets["mqtt"]["port"],
+                             secrets["mqtt"]["user"],
+                             secrets["mqtt"]["password"],
+                             5)
+    scanner = None
+    if secrets.get("passive", constants.PASSIVE_ADVERTISEMENTS):
+        scanner = AdvertisementScanner()
+        loop.create_task(scanner.run())
+    hub = CurtainHub(
+        mqtt_client, curtains_from_secrets(secrets), secrets.get("on_demand", constants.ON_DEMAND_CONNECTION),
+        scanner, secrets.get("max_connections", constants.MAX_BLE_CONNECTIONS), groups_from_secrets(secrets))
+    wifiutils.register_on_connect_callback(hub.connect)
+    hub.connect(True)
+    hub.start()
     loop.run_forever()
 
 loop.create_task(main())
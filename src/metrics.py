@@ -0,0 +1,64 @@
+import array
+
+# Upper bounds of the histogram buckets in milliseconds, the last bucket
+# holds everything above the final bound.
+DEFAULT_BOUNDS_MS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+class Histogram:
+    def __init__(self, bounds=DEFAULT_BOUNDS_MS):
+        self._bounds = bounds
+        self._counts = array.array("L", [0] * (len(bounds) + 1))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        index = 0
+        bounds = self._bounds
+        while index < len(bounds) and value > bounds[index]:
+            index += 1
+        self._counts[index] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def reset(self):
+        for i in range(len(self._counts)):
+            self._counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket the percentile falls in (or max).
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                if index < len(self._bounds):
+                    return min(self._bounds[index], self.max)
+                return self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+        }
@@ -0,0 +1,105 @@
+import utime
+
+import constants
+import metrics
+
+INCREASING = "increasing"
+DECREASING = "decreasing"
+
+
+class MotionModel:
+    def __init__(self, speeds=None):
+        # Travel speed in percent per second for each direction.
+        self.speeds = {
+            INCREASING: constants.DEFAULT_CURTAIN_SPEED,
+            DECREASING: constants.DEFAULT_CURTAIN_SPEED,
+        }
+        if speeds:
+            self.speeds.update(speeds)
+        self._saved_speeds = dict(self.speeds)
+        self._saved_ticks = None
+        self.prediction_error = metrics.Histogram(constants.PREDICTION_ERROR_BOUNDS)
+        self._direction = INCREASING
+        self._target = None
+        self._position = None
+        self._ticks = None
+
+    @property
+    def is_moving(self):
+        return self._ticks is not None
+
+    @property
+    def direction(self):
+        return self._direction
+
+    @property
+    def speed(self):
+        return self.speeds[self._direction]
+
+    def start(self, target):
+        self._target = target
+        if target is not None and self._position is not None and target != self._position:
+            self._direction = INCREASING if target > self._position else DECREASING
+        self._ticks = utime.ticks_ms()
+
+    def stop(self):
+        self._target = None
+        self._ticks = None
+
+    def update(self, position):
+        now = utime.ticks_ms()
+        if self.is_moving and self._position is not None:
+            self.prediction_error.record(abs(self.predicted_position() - position))
+            if position != self._position:
+                self._direction = INCREASING if position > self._position else DECREASING
+                elapsed = utime.ticks_diff(now, self._ticks) / 1000
+                if elapsed > 0:
+                    measured = abs(position - self._position) / elapsed
+                    self.speeds[self._direction] += constants.CURTAIN_SPEED_SMOOTHING * (
+                        measured - self.speed)
+        self._position = position
+        if self.is_moving:
+            self._ticks = now
+
+    @property
+    def needs_saving(self):
+        # The speeds live in flash, so only a real drift is written, and
+        # not more often than the save interval.
+        if self._saved_ticks is not None and utime.ticks_diff(
+                utime.ticks_ms(), self._saved_ticks) < constants.CALIBRATION_SAVE_INTERVAL_MS:
+            return False
+        for direction, speed in self.speeds.items():
+            saved = self._saved_speeds[direction]
+            if abs(speed - saved) > constants.CALIBRATION_SAVE_THRESHOLD * saved:
+                return True
+        return False
+
+    def mark_saved(self):
+        self._saved_speeds = dict(self.speeds)
+        self._saved_ticks = utime.ticks_ms()
+
+    def predicted_position(self):
+        # After a stop there is no target, so hold the last known position.
+        if self._target is None or self._position is None or not self.is_moving:
+            return self._position
+        elapsed = utime.ticks_diff(utime.ticks_ms(), self._ticks) / 1000
+        travelled = self.speed * elapsed
+        if self._target > self._position:
+            return int(min(self._target, self._position + travelled))
+        return int(max(self._target, self._position - travelled))
+
+    def remaining_ms(self):
+        if self._target is None or self._position is None:
+            return None
+        remaining = abs(self._target - self._position)
+        elapsed = utime.ticks_diff(utime.ticks_ms(), self._ticks) / 1000
+        return max(0, int((remaining / self.speed - elapsed) * 1000))
+
+    def next_poll_ms(self):
+        # Poll sparsely while the curtain is far away and densely near the
+        # predicted arrival; without a target just poll as often as allowed.
+        remaining = self.remaining_ms()
+        if remaining is None:
+            return constants.MIN_POLL_INTERVAL_MS
+        return min(constants.MAX_POLL_INTERVAL_WHILE_MOVING_MS,
+                   max(constants.MIN_POLL_INTERVAL_MS, remaining // 2))
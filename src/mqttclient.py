@@ -0,0 +1,318 @@
+import uasyncio as asyncio
+import ulogging
+import utime
+
+import constants
+import metrics
+
+log = ulogging.getLogger(__name__)
+log.setLevel(ulogging.DEBUG)
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+DUP = 0x08
+QOS_1 = 0x02
+PUBACK = 0x40
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+UNSUBSCRIBE = 0xA2
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+
+class MQTTException(Exception):
+    pass
+
+
+def _length(size):
+    encoded = bytearray()
+    while True:
+        byte = size & 0x7F
+        size >>= 7
+        if size:
+            byte |= 0x80
+        encoded.append(byte)
+        if not size:
+            return encoded
+
+
+def _string(value):
+    if isinstance(value, str):
+        value = value.encode()
+    return len(value).to_bytes(2, "big") + value
+
+
+def _packet(header, body):
+    return bytes([header]) + _length(len(body)) + body
+
+
+class MQTTClient:
+    # Same surface as umqtt.simple, but reading is a coroutine that wakes
+    # when the socket has data and writes go through the stream buffer.
+    def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0,
+                 window=constants.MQTT_IN_FLIGHT_WINDOW):
+        self.client_id = client_id
+        self.server = server
+        self.port = port or 1883
+        self.user = user
+        self.password = password
+        self.keepalive = keepalive
+        self._callback = None
+        self._last_will = None
+        self._reader = None
+        self._writer = None
+        # Packets waiting for the flush task, see _flush.
+        self._out = bytearray()
+        self._flush_requested = asyncio.Event()
+        self._flushed = asyncio.Event()
+        self._flushed.set()
+        self._packet_id = 0
+        # QoS 1 publishes waiting for their PUBACK, by packet id.
+        self._window = window
+        self._in_flight = {}
+        self._window_open = asyncio.Event()
+        self._window_open.set()
+        self._pong = asyncio.Event()
+        self.puback_latency = metrics.Histogram()
+        self.retransmits = 0
+        self.connects = 0
+        self.received = 0
+        self.sent = 0
+        self.sent_bytes = 0
+
+    def set_callback(self, callback):
+        self._callback = callback
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        self._last_will = (topic, msg, retain, qos)
+
+    @property
+    def is_connected(self):
+        return self._writer is not None
+
+    async def connect(self, clean_session=True):
+        await self.disconnect()
+        reader, writer = await asyncio.wait_for_ms(
+            asyncio.open_connection(self.server, self.port), constants.MQTT_CONNECT_TIMEOUT_MS)
+        flags = 0x02 if clean_session else 0
+        payload = _string(self.client_id)
+        if self._last_will:
+            topic, msg, retain, qos = self._last_will
+            flags |= 0x04 | qos << 3 | retain << 5
+            payload += _string(topic) + _string(msg)
+        if self.user is not None:
+            flags |= 0x80
+            payload += _string(self.user)
+            if self.password is not None:
+                flags |= 0x40
+                payload += _string(self.password)
+        body = b"\x00\x04MQTT\x04" + bytes([flags]) + self.keepalive.to_bytes(2, "big") + payload
+        try:
+            writer.write(_packet(CONNECT, body))
+            await writer.drain()
+            response = await asyncio.wait_for_ms(reader.readexactly(4), constants.MQTT_CONNECT_TIMEOUT_MS)
+        except (OSError, EOFError, asyncio.TimeoutError):  # type: ignore
+            await self._close(writer)
+            raise
+        if response[0] != CONNACK or response[1] != 2:
+            await self._close(writer)
+            raise OSError("Unexpected CONNACK")
+        if response[3]:
+            await self._close(writer)
+            raise MQTTException(response[3])
+        self._reader, self._writer = reader, writer
+        asyncio.get_event_loop().create_task(self._flush(writer))
+        self.connects += 1
+        self._retransmit()
+        return response[2] & 1
+
+    def _retransmit(self):
+        # Anything the broker didn't acknowledge before the link went goes
+        # out again, flagged as a duplicate.
+        for packet_id, entry in self._in_flight.items():
+            packet = entry[0]
+            packet[0] |= DUP
+            self._send(packet)
+            entry[1] = utime.ticks_ms()
+            self.retransmits += 1
+
+    async def disconnect(self):
+        writer = self._writer
+        if writer is None:
+            return
+        idle = self._flushed.is_set()
+        self._lost()
+        if idle:
+            # Only say goodbye when the flush task isn't draining already.
+            try:
+                writer.write(_packet(DISCONNECT, b""))
+                await writer.drain()
+            except OSError:  # type: ignore
+                pass
+        await self._close(writer)
+
+    @staticmethod
+    async def _close(writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except OSError:  # type: ignore
+            pass
+
+    def _lost(self):
+        self._reader = self._writer = None
+        self._out = bytearray()
+        # Wakes the flush task so it sees its stream is gone, and anyone
+        # waiting for a flush.
+        self._flush_requested.set()
+        self._flushed.set()
+        self._window_open.set()
+
+    def _next_packet_id(self):
+        while True:
+            self._packet_id = self._packet_id % 0xFFFF + 1
+            if self._packet_id not in self._in_flight:
+                return self._packet_id
+
+    @property
+    def window_full(self):
+        return len(self._in_flight) >= self._window
+
+    async def wait_for_window(self):
+        # Returns once a QoS 1 publish can go out, or the connection is gone.
+        while self.window_full and self.is_connected:
+            self._window_open.clear()
+            await self._window_open.wait()
+
+    def _send(self, packet):
+        if self._writer is None:
+            raise OSError("MQTT not connected")
+        self._out += packet
+        self.sent += 1
+        self.sent_bytes += len(packet)
+        self._flushed.clear()
+        self._flush_requested.set()
+
+    async def _flush(self, writer):
+        # The only task that writes to the stream, the firmware's uasyncio
+        # allows one writer to wait on a socket at a time. Its drain() sends
+        # the buffer it started with and then drops the stream's buffer, so
+        # packets collect in _out and are only handed over between drains.
+        while True:
+            await self._flush_requested.wait()
+            if writer is not self._writer:
+                return
+            self._flush_requested.clear()
+            out, self._out = self._out, bytearray()
+            try:
+                writer.write(out)
+                await writer.drain()
+            except OSError as e:  # type: ignore
+                log.exc(e, "Failed to send to the broker")
+                if writer is self._writer:
+                    self._lost()
+                return
+            if not self._flush_requested.is_set():
+                self._flushed.set()
+
+    async def flush(self):
+        # Waits until everything written so far has left the stream buffer.
+        await self._flushed.wait()
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        if isinstance(msg, str):
+            msg = msg.encode()
+        if not qos:
+            self._send(_packet(PUBLISH | retain, _string(topic) + msg))
+            return None
+        if self.window_full:
+            raise OSError("MQTT in-flight window full")
+        packet_id = self._next_packet_id()
+        packet = bytearray(_packet(
+            PUBLISH | QOS_1 | retain, _string(topic) + packet_id.to_bytes(2, "big") + msg))
+        self._send(packet)
+        self._in_flight[packet_id] = [packet, utime.ticks_ms()]
+        return packet_id
+
+    def subscribe(self, topic, qos=0):
+        self._send(_packet(SUBSCRIBE, self._next_packet_id().to_bytes(2, "big") + _string(topic) + bytes([qos])))
+
+    def unsubscribe(self, topic):
+        self._send(_packet(UNSUBSCRIBE, self._next_packet_id().to_bytes(2, "big") + _string(topic)))
+
+    def ping(self):
+        self._send(_packet(PINGREQ, b""))
+
+    async def round_trip(self, timeout_ms):
+        # The broker answers in order, so once the PINGRESP is in so is
+        # everything it sent for the packets before the ping.
+        self._pong.clear()
+        self.ping()
+        try:
+            await asyncio.wait_for_ms(self._pong.wait(), timeout_ms)
+            return True
+        except asyncio.TimeoutError:  # type: ignore
+            return False
+
+    async def wait_msg(self):
+        reader = self._reader
+        if reader is None:
+            raise OSError("MQTT not connected")
+        try:
+            header = (await reader.readexactly(1))[0]
+            size = 0
+            shift = 0
+            while True:
+                byte = (await reader.readexactly(1))[0]
+                size |= (byte & 0x7F) << shift
+                shift += 7
+                if not byte & 0x80:
+                    break
+            body = await reader.readexactly(size) if size else b""
+        except (OSError, EOFError):  # type: ignore
+            if reader is not self._reader:
+                # A reconnect replaced the stream we were reading.
+                return None
+            writer = self._writer
+            self._lost()
+            await self._close(writer)
+            raise
+        if header & 0xF0 == PUBLISH:
+            self._on_publish(header, body)
+        elif header & 0xF0 == PUBACK:
+            self._on_puback(body[0] << 8 | body[1])
+        elif header & 0xF0 == PINGRESP:
+            self._pong.set()
+        return header & 0xF0
+
+    def _on_puback(self, packet_id):
+        entry = self._in_flight.pop(packet_id, None)
+        if entry is None:
+            return
+        self.puback_latency.record(utime.ticks_diff(utime.ticks_ms(), entry[1]))
+        self._window_open.set()
+
+    def _on_publish(self, header, body):
+        self.received += 1
+        topic_end = 2 + (body[0] << 8 | body[1])
+        topic = body[2:topic_end]
+        msg_start = topic_end
+        if header & 0x06:
+            packet_id = body[topic_end:topic_end + 2]
+            msg_start += 2
+            self._send(_packet(PUBACK, packet_id))
+        if self._callback:
+            self._callback(topic, body[msg_start:])
+
+    def stats(self):
+        return {
+            "connects": self.connects,
+            "received": self.received,
+            "sent": self.sent,
+            "sent_bytes": self.sent_bytes,
+            "in_flight": len(self._in_flight),
+            "retransmits": self.retransmits,
+            "puback_latency": self.puback_latency.to_dict(),
+        }
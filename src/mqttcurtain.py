@@ -1,123 +1,159 @@
 import json
 import uasyncio as asyncio
 import ulogging
-import umqtt.simple as mqtt
 import wifiutils
+import connectionstate
 import constants
+import curtaincommands
+import coverstate
 from bluetoothcover import BluetoothCover
+from commandscheduler import CommandScheduler
+from curtaintopics import CurtainTopics
+from mqttclient import MQTTClient
+from publishcache import PublishCache
 
 log = ulogging.getLogger(__name__)
 log.setLevel(ulogging.DEBUG)
 
 
 class MQTTCurtain:
-    def __init__(self, client: mqtt.MQTTClient, mac):
+    def __init__(self, client: MQTTClient, mac, on_demand=constants.ON_DEMAND_CONNECTION, scanner=None,
+                 topics=None, connection_scheduler=None, outbound=None,
+                 refresh_interval_ms=constants.PUBLISH_REFRESH_INTERVAL_MS):
         self.client = client
+        self.topics = topics or CurtainTopics(constants.CLIENT_ID)
+        self._outbound = outbound
+        self._published = PublishCache(self.publish, refresh_interval_ms)
         self._cover_online = None
+        self._predicted_position = None
+        self._state_listeners = []
         self.cover: BluetoothCover = BluetoothCover(
-            mac, self.on_bluetooth_cover_state_changed, self.on_bluetooth_command_executed, True)
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(self.cover.connect())
-        loop.run_until_complete(self.cover.start_listening())
-
-    def connect(self, clear=False):
-        try:
-            self.client.set_callback(self.on_message)
-            self.client.set_last_will(
-                constants.ESP_AVAILIBILITY_TOPIC, "offline", True)
-            self.client.connect(clear)
-            self.client.subscribe(constants.SET_COMMAND_TOPIC)
-            self.client.subscribe(constants.ESP_AVAILIBILITY_TOPIC)
-            self.client.subscribe(constants.SET_POSITION_TOPIC)
-            self.publish_discovery_data()
-            self.publish_esp_online()
-        except OSError:  # type: ignore
-            log.debug("Failed to connect")
-
-    def publish_esp_online(self):
-        self.publish(constants.ESP_AVAILIBILITY_TOPIC, "online", True)
-
-    def publish_discovery_data(self):
-        self.publish(
-            constants.DISCOVERY_TOPIC,
-            json.dumps(constants.MQTT_DISCOVERY_DATA),
-            True
-        )
-        self.publish(
-            constants.BATTERY_DISCOVERY_TOPIC,
-            json.dumps(constants.MQTT_BATTERY_DISCOVERY_DATA),
-            True
+            mac, self.on_bluetooth_cover_state_changed, self.on_bluetooth_command_executed, True,
+            on_connection_state_changed_callback=self.on_bluetooth_connection_state_changed,
+            on_demand=on_demand, connection_scheduler=connection_scheduler)
+        self.scheduler = CommandScheduler(self.cover)
+        if scanner:
+            scanner.register(self.cover.addr, self.cover.on_advertisement)
+        if connection_scheduler:
+            connection_scheduler.add(self.topics.device_id, self.cover)
+        asyncio.get_event_loop().create_task(self.cover.init())
+
+    def subscribe(self):
+        for topic in self.topics.subscriptions:
+            self.client.subscribe(topic, self.topics.qos(topic))
+
+    def discovery_documents(self):
+        return (
+            (self.topics.discovery, self.topics.discovery_data()),
+            (self.topics.battery_discovery, self.topics.battery_discovery_data()),
         )
 
-    def on_bluetooth_cover_state_changed(self, cover: BluetoothCover):
-        log.debug("Cover state changed to %s", cover.state)
-        log.debug("Cover adv_state changed to %s", cover.adv_state)
-        if cover.motion_status:
-            self.publish(constants.STATE_TOPIC, cover.motion_status, True)
-        if cover.position is not None:
-            self.publish(constants.POSITION_TOPIC, f"{cover.position}", True)
-        if cover.state:
-            self.publish(constants.ATTRIBUTES_TOPIC,
-                         json.dumps(cover.state), True)
-        if cover.battery is not None:
-            self.publish(constants.BATTERY_STATE_TOPIC,
-                         f"{cover.battery}", True)
-        if cover.adv_state:
-            self.publish(constants.BATTERY_ATTRIBUTES_TOPIC,
-                         json.dumps(cover.adv_state), True)
+    def add_state_listener(self, listener):
+        self._state_listeners.append(listener)
+
+    def on_bluetooth_cover_state_changed(self, snapshot: coverstate.CoverSnapshot, changed: int):
+        if changed:
+            # Formatting the snapshot costs more than the rest of an
+            # unchanged notification.
+            log.debug("Cover state changed (%s) to %s", changed, snapshot)
+        for listener in self._state_listeners:
+            listener(snapshot, changed)
+        # Every field goes through the cache, not just the changed ones:
+        # it skips unchanged values but still refreshes them once the
+        # refresh interval is up, and retries values that failed to queue.
+        # Values are compared before they are serialized, so an unchanged
+        # attributes dict never reaches json.dumps.
+        self._predicted_position = None
+        published = self._published
+        topics = self.topics
+        if snapshot.motion_status:
+            published.publish(topics.state, snapshot.motion_status)
+        if snapshot.position is not None:
+            # Also replaces the last prediction with the real position.
+            published.publish(topics.position, snapshot.position)
+        if snapshot.state:
+            published.publish(topics.attributes, snapshot.state, json.dumps)
+        if snapshot.battery is not None:
+            published.publish(topics.battery_state, snapshot.battery)
+        if snapshot.adv_state:
+            published.publish(topics.battery_attributes, snapshot.adv_state, json.dumps)
+
+    def on_bluetooth_connection_state_changed(self, previous, state):
+        if self.cover.on_demand:
+            # Being disconnected is the resting state, only failing to
+            # reconnect makes the cover unavailable.
+            if state in (connectionstate.SUBSCRIBED, connectionstate.BACKOFF):
+                self.on_bluetooth_command_executed(state == connectionstate.SUBSCRIBED)
+            return
+        self.on_bluetooth_command_executed(state == connectionstate.SUBSCRIBED)
 
     def on_bluetooth_command_executed(self, did_succeed):
         if did_succeed != self._cover_online:
             status = "online" if did_succeed else "offline"
-            if self.publish(constants.COVER_AVAILIBILITY_TOPIC, status, True):
+            if self.publish(self.topics.availability, status, True):
                 self._cover_online = did_succeed
 
     async def handle_message(self, topic: str, msg: str):
-        if (topic == constants.ESP_AVAILIBILITY_TOPIC and msg != "online"):
-            self.publish_esp_online()
-        elif topic == constants.SET_COMMAND_TOPIC:
+        if topic == self.topics.set_command:
             await self._handle_command(msg)
-        elif topic == constants.SET_POSITION_TOPIC:
-            await self._handle_position(int(msg))
+        elif topic == self.topics.set_position:
+            position = curtaincommands.parse_position(msg)
+            if position is None:
+                log.warning("Ignored invalid position %s", msg)
+            else:
+                await self._handle_position(position)
+        elif topic == self.topics.diagnostics_command:
+            self._handle_diagnostics(msg)
 
     async def _handle_position(self, position: int):
-        await self.cover.move_to(position)
+        self.scheduler.move_to(position)
 
     async def _handle_command(self, command: str):
         if command == "STOP":
-            await self.cover.stop()
+            self.scheduler.stop()
         elif command == "OPEN":
-            await self.cover.open()
+            self.scheduler.open()
         elif command == "CLOSE":
-            await self.cover.close()
+            self.scheduler.close()
 
-    def on_message(self, topic, msg):
-        topic = topic.decode('UTF-8')
-        msg = msg.decode('UTF-8')
-        log.info("Topic: %s sent message: %s", topic, msg)
-        asyncio.get_event_loop().create_task(self.handle_message(topic, msg))
+    def _handle_diagnostics(self, command: str):
+        if command == "DUMP_PACKETS":
+            self.publish(self.topics.packets_diagnostics,
+                         "\n".join(self.cover.packet_log.dump()))
+        elif command == "CLEAR_PACKETS":
+            self.cover.packet_log.clear()
+        elif command == "DUMP_STATS":
+            self.publish(self.topics.stats_diagnostics, json.dumps(self._stats()))
 
-    async def ping(self):
-        while True:
-            if wifiutils.is_network_connected():
-                try:
-                    self.client.ping()
-                except OSError as e:  # type: ignore
-                    log.exc(e, "Error while pinging")
-                    self.connect()
-            await asyncio.sleep(2)
-
-    async def await_message(self):
+    def _stats(self):
+        return {
+            "commands": self.scheduler.stats(),
+            "connection": self.cover.connection_stats(),
+            "latency": self.cover.latency_stats(),
+            "notifications": self.cover.notification_stats(),
+            "polls_per_move": self.cover.polls_per_move.to_dict(),
+            "prediction_error": self.cover.prediction_error.to_dict(),
+            "publishes": self._published.stats(),
+            "advertisements": {
+                "decoded": self.cover.advertisements,
+                "skipped_polls": self.cover.skipped_polls,
+            },
+        }
+
+    async def publish_predictions(self):
         while True:
-            if wifiutils.is_network_connected():
-                try:
-                    self.client.check_msg()
-                except OSError as e:  # type: ignore
-                    log.exc(e, "Error while awaiting message")
-                    self.connect()
-            await asyncio.sleep_ms(200)
+            if self.cover.is_moving:
+                position = self.cover.predicted_position
+                if position is not None and position != self._predicted_position:
+                    if self._published.publish(self.topics.position, position):
+                        self._predicted_position = position
+            await asyncio.sleep_ms(constants.INTERPOLATION_INTERVAL_MS)
 
     def publish(self, topic, data, persist=False):
+        if self._outbound is not None:
+            log.debug("Queueing %s to %s", data, topic)
+            return self._outbound.put(topic, data, persist, self.topics.qos(topic))
+
         def sendMessage():
             try:
                 log.debug("Publishing %s to %s", data, topic)
@@ -125,7 +161,6 @@ class MQTTCurtain:
                 return True
             except (OSError, AttributeError):  # type: ignore
                 log.warning("Failed to publish message to topic %s", topic)
-                self.connect()
                 return False
         if wifiutils.is_network_connected():
             return sendMessage()
@@ -0,0 +1,138 @@
+import uasyncio as asyncio
+import ulogging
+
+import constants
+
+log = ulogging.getLogger(__name__)
+log.setLevel(ulogging.DEBUG)
+
+TOPIC = 0
+DATA = 1
+RETAIN = 2
+QOS = 3
+
+
+class OutboundQueue:
+    # Publishes are only queued by the caller and written by run(), so the
+    # BLE notification path never waits on the network. While the broker is
+    # unreachable a retained topic keeps just its newest value.
+    def __init__(self, client, on_failed=None, max_messages=constants.OUTBOUND_QUEUE_MESSAGES,
+                 max_bytes=constants.OUTBOUND_QUEUE_BYTES, burst=constants.OUTBOUND_BURST):
+        self._client = client
+        self._on_failed = on_failed
+        self._max_messages = max_messages
+        self._max_bytes = max_bytes
+        self._burst = burst
+        self._queue = []
+        self._retained = {}
+        self._bytes = 0
+        self._ready = asyncio.Event()
+        self.queued = 0
+        self.collapsed = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.flushes = 0
+        self.high_water = 0
+        self.blocked = 0
+        self.window_waits = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, topic, data, retain=False, qos=0):
+        entry = self._retained.get(topic) if retain else None
+        if entry is not None:
+            # Still waiting to go out, just swap in the newer value.
+            self._bytes += len(data) - len(entry[DATA])
+            entry[DATA] = data
+            entry[QOS] = max(entry[QOS], qos)
+            self.collapsed += 1
+            return True
+        size = len(topic) + len(data)
+        if not self._make_room(size):
+            self.dropped += 1
+            log.warning("Outbound queue full, dropped %s", topic)
+            return False
+        entry = [topic, data, retain, qos]
+        self._queue.append(entry)
+        if retain:
+            self._retained[topic] = entry
+        self._bytes += size
+        self.queued += 1
+        self.high_water = max(self.high_water, len(self._queue))
+        self._ready.set()
+        return True
+
+    def _make_room(self, size):
+        # Retained state outlives one-off messages, so those go first.
+        while len(self._queue) >= self._max_messages or self._bytes + size > self._max_bytes:
+            for index, entry in enumerate(self._queue):
+                if not entry[RETAIN]:
+                    self._remove(index)
+                    self.dropped += 1
+                    break
+            else:
+                return False
+        return True
+
+    def _remove(self, index):
+        entry = self._queue.pop(index)
+        if entry[RETAIN]:
+            del self._retained[entry[TOPIC]]
+        self._bytes -= len(entry[TOPIC]) + len(entry[DATA])
+        return entry
+
+    def resume(self):
+        # Called once the client is connected again.
+        self._ready.set()
+
+    async def run(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            if self._queue and self._client.is_connected:
+                await self._send_all()
+
+    async def _send_all(self):
+        self.flushes += 1
+        written = 0
+        while self._queue and self._client.is_connected:
+            entry = self._queue[0]
+            if entry[QOS] and self._client.window_full:
+                # Wait for a PUBACK instead of piling up unacknowledged publishes.
+                self.window_waits += 1
+                await self._client.wait_for_window()
+                continue
+            try:
+                self._client.publish(entry[TOPIC], entry[DATA], entry[RETAIN], entry[QOS])
+            except OSError as e:  # type: ignore
+                # Leave it queued for the next connection.
+                log.exc(e, "Failed to publish message to topic %s", entry[TOPIC])
+                self.failed += 1
+                if self._on_failed:
+                    self._on_failed()
+                return
+            self._remove(0)
+            self.sent += 1
+            written += 1
+            if written % self._burst == 0:
+                # Let the stream drain before buffering more.
+                self.blocked += 1
+                await self._client.flush()
+        await self._client.flush()
+
+    def stats(self):
+        return {
+            "pending": len(self._queue),
+            "pending_bytes": self._bytes,
+            "queued": self.queued,
+            "collapsed": self.collapsed,
+            "dropped": self.dropped,
+            "sent": self.sent,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "high_water": self.high_water,
+            "blocked": self.blocked,
+            "window_waits": self.window_waits,
+        }
@@ -0,0 +1,57 @@
+import array
+import ubinascii
+import utime
+
+TX = 0
+RX = 1
+_DIRECTION_NAMES = ("TX", "RX")
+
+
+class PacketLog:
+    def __init__(self, size, frame_size):
+        self._size = size
+        self._frame_size = frame_size
+        self._frames = bytearray(size * frame_size)
+        self._lengths = bytearray(size)
+        self._directions = bytearray(size)
+        self._ticks = array.array("L", [0] * size)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def record(self, direction, frame):
+        # Called for every frame on the BLE hot path, so only copy bytes here.
+        index = self._next
+        length = min(len(frame), self._frame_size)
+        offset = index * self._frame_size
+        frames = self._frames
+        for i in range(length):
+            frames[offset + i] = frame[i]
+        self._lengths[index] = length
+        self._directions[index] = direction
+        self._ticks[index] = utime.ticks_ms()
+        self._next = (index + 1) % self._size
+        if self._count < self._size:
+            self._count += 1
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def dump(self):
+        # Oldest first, rendered to hex only when someone asks for it.
+        first = (self._next - self._count) % self._size
+        for n in range(self._count):
+            index = (first + n) % self._size
+            offset = index * self._frame_size
+            frame = self._frames[offset:offset + self._lengths[index]]
+            yield "{} {} {}".format(
+                self._ticks[index],
+                _DIRECTION_NAMES[self._directions[index]],
+                ubinascii.hexlify(frame, "-").decode())
+
+    def print_dump(self):
+        for line in self.dump():
+            print(line)
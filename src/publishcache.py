@@ -0,0 +1,51 @@
+import utime
+
+import constants
+
+
+class PublishCache:
+    # Remembers the last value sent to each topic so unchanged values are
+    # only serialized and sent again once the refresh interval is up.
+    def __init__(self, publish, refresh_interval_ms=constants.PUBLISH_REFRESH_INTERVAL_MS):
+        self._publish = publish
+        self._refresh_interval_ms = refresh_interval_ms
+        self._last = {}
+        self.published = 0
+        self.published_bytes = 0
+        self.refreshed = 0
+        self.saved = 0
+        self.saved_bytes = 0
+
+    def publish(self, topic, value, encode=str, persist=True):
+        now = utime.ticks_ms()
+        last = self._last.get(topic)
+        # Snapshots reuse unchanged attribute dicts, so identity usually decides.
+        if last is not None and (last[0] is value or last[0] == value):
+            if utime.ticks_diff(now, last[1]) < self._refresh_interval_ms:
+                self.saved += 1
+                self.saved_bytes += last[2]
+                return True
+            self.refreshed += 1
+        data = encode(value)
+        if not self._publish(topic, data, persist):
+            return False
+        size = len(topic) + len(data)
+        self._last[topic] = (value, now, size)
+        self.published += 1
+        self.published_bytes += size
+        return True
+
+    def forget(self, topic=None):
+        if topic is None:
+            self._last.clear()
+        else:
+            self._last.pop(topic, None)
+
+    def stats(self):
+        return {
+            "published": self.published,
+            "published_bytes": self.published_bytes,
+            "refreshed": self.refreshed,
+            "saved": self.saved,
+            "saved_bytes": self.saved_bytes,
+        }
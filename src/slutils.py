@@ -20,6 +20,13 @@ def _read_json_file(file_name):
     return data
 
 
+def _read_optional_json_file(file_name):
+    try:
+        return _read_json_file(file_name)
+    except (OSError, ValueError):  # type: ignore
+        return {}
+
+
 def write_secrets(data):
     _write_json_file("secrets.json", data)
 
@@ -28,6 +35,22 @@ def read_secrets():
     return _read_json_file("secrets.json")
 
 
+def write_calibration(data):
+    _write_json_file("calibration.json", data)
+
+
+def read_calibration():
+    return _read_optional_json_file("calibration.json")
+
+
+def write_gatt_cache(data):
+    _write_json_file("gattcache.json", data)
+
+
+def read_gatt_cache():
+    return _read_optional_json_file("gattcache.json")
+
+
 class NamedEnum:  # pylint: disable=too-few-public-methods
     def __init__(self, name, value):
         self.name = name